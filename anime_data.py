@@ -2,6 +2,7 @@
 🎌 База данных аниме для игры "Угадай Аниме"
 Содержит: аниме с цитатами, MAL ID для картинок, редкость, достижения, ранги
 """
+from bisect import bisect_right
 
 # ============ РЕДКОСТЬ ============
 RARITY_COMMON = "common"
@@ -43,34 +44,43 @@ RANKS = [
 ]
 
 
+# Таблица рангов для бинарного поиска (RANKS отсортирован по min_xp)
+RANK_MIN_XP = [rank["min_xp"] for rank in RANKS]
+
+# Готовые полоски прогресса: XP_BARS[n] — n заполненных делений из 10
+XP_BARS = ["█" * filled + "░" * (10 - filled) for filled in range(11)]
+
+
+def get_rank_index(xp: int) -> int:
+    """Индекс текущего ранга в RANKS"""
+    return max(bisect_right(RANK_MIN_XP, xp) - 1, 0)
+
+
 def get_rank(xp: int) -> dict:
     """Получить текущий ранг по XP"""
-    current_rank = RANKS[0]
-    for rank in RANKS:
-        if xp >= rank["min_xp"]:
-            current_rank = rank
-    return current_rank
+    return RANKS[get_rank_index(xp)]
 
 
 def get_next_rank(xp: int) -> dict | None:
     """Получить следующий ранг"""
-    for i, rank in enumerate(RANKS):
-        if xp < rank["min_xp"]:
-            return rank
-    return None
+    index = bisect_right(RANK_MIN_XP, xp)
+    return RANKS[index] if index < len(RANKS) else None
+
+
+def ranks_for(xps) -> list:
+    """Ранги для списка значений XP (например, для страницы топа)"""
+    return [RANKS[get_rank_index(xp)] for xp in xps]
 
 
 def get_xp_progress(xp: int) -> str:
     """Прогресс-бар до следующего ранга"""
-    next_rank = get_next_rank(xp)
-    if not next_rank:
-        return "██████████ MAX"
-    current = get_rank(xp)
-    total = next_rank["min_xp"] - current["min_xp"]
-    progress = xp - current["min_xp"]
-    filled = int((progress / total) * 10)
-    bar = "█" * filled + "░" * (10 - filled)
-    return f"{bar} {progress}/{total}"
+    index = get_rank_index(xp)
+    if index + 1 >= len(RANKS):
+        return f"{XP_BARS[10]} MAX"
+    total = RANK_MIN_XP[index + 1] - RANK_MIN_XP[index]
+    progress = xp - RANK_MIN_XP[index]
+    filled = min(max(progress * 10 // total, 0), 10)
+    return f"{XP_BARS[filled]} {progress}/{total}"
 
 
 # ============ ДОСТИЖЕНИЯ ============
@@ -227,6 +237,18 @@ ACHIEVEMENTS = {
     },
 }
 
+# Порядок достижений и их биты (маска открытых достижений игрока)
+ACHIEVEMENT_IDS = list(ACHIEVEMENTS)
+ACHIEVEMENT_BITS = {ach_id: 1 << i for i, ach_id in enumerate(ACHIEVEMENT_IDS)}
+
+
+def get_achievements_mask(achievement_ids) -> int:
+    """Битовая маска открытых достижений по их ID"""
+    mask = 0
+    for ach_id in achievement_ids:
+        mask |= ACHIEVEMENT_BITS.get(ach_id, 0)
+    return mask
+
 
 # ============ БАЗА АНИМЕ ============
 # mal_id используется для загрузки картинок через Jikan API
@@ -1096,17 +1118,35 @@ ANIME_LIST = [
 ]
 
 
+# ============ ИНДЕКСЫ КАТАЛОГА ============
+ANIME_BY_ID: dict[int, dict] = {}
+QUOTE_POOL: list[dict] = []                   # Аниме с цитатами
+RARITY_POOLS: dict[str, list[dict]] = {}      # редкость -> аниме этой редкости
+CATALOG_STATE = {"version": 0}                # Растёт при каждой переиндексации
+
+
+def reindex_catalog():
+    """Пересобрать индексы каталога (после изменения ANIME_LIST)"""
+    ANIME_BY_ID.clear()
+    ANIME_BY_ID.update((anime["id"], anime) for anime in ANIME_LIST)
+    QUOTE_POOL[:] = [anime for anime in ANIME_LIST if anime.get("quotes")]
+    RARITY_POOLS.clear()
+    for anime in ANIME_LIST:
+        RARITY_POOLS.setdefault(anime["rarity"], []).append(anime)
+    CATALOG_STATE["version"] += 1
+
+
+reindex_catalog()
+
+
 def get_anime_by_id(anime_id: int) -> dict | None:
     """Получить аниме по ID"""
-    for anime in ANIME_LIST:
-        if anime["id"] == anime_id:
-            return anime
-    return None
+    return ANIME_BY_ID.get(anime_id)
 
 
 def get_anime_with_quotes() -> list:
-    """Получить только аниме, у которых есть цитаты"""
-    return [a for a in ANIME_LIST if a.get("quotes")]
+    """Получить только аниме, у которых есть цитаты (общий список — не изменять)"""
+    return QUOTE_POOL
 
 
 def get_all_rarities_set() -> set:
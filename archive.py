@@ -0,0 +1,219 @@
+"""
+🗃 Архив холодной истории игр
+Старые строки game_history уезжают из SQLite в сегменты по дням:
+history_archive/YYYY-MM-DD.seg.gz, при DB_SHARDS>1 — в свой подкаталог
+шарда history_archive/shard<N>/ (id у шардов свои). Каждая запись в
+сегмент — отдельный gzip-member с колоночными массивами, файл только
+дописывается.
+
+Формат кадра (внутри gzip-потока кадры идут подряд):
+    4 байта — длина заголовка (little-endian)
+    заголовок — JSON: {"rows", "byteorder", "modes", "columns": [[имя, typecode, байт], ...]}
+    колонки — сырые байты array.array в порядке заголовка
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import struct
+import sys
+from array import array
+from datetime import datetime, timezone
+
+SEGMENT_SUFFIX = ".seg.gz"
+
+# Колонки game_history: имя -> typecode массива (mode хранится кодом из словаря "modes")
+COLUMNS = (
+    ("id", "q"),
+    ("user_id", "q"),
+    ("mode", "B"),
+    ("anime_id", "i"),
+    ("was_correct", "B"),
+    ("xp_earned", "i"),
+    ("played_at", "q"),   # unix-время, UTC
+)
+
+
+def segment_path(directory: str, day: str) -> str:
+    return os.path.join(directory, f"{day}{SEGMENT_SUFFIX}")
+
+
+def _encode(rows: list) -> bytes:
+    """Строки (id, user_id, mode, anime_id, was_correct, xp_earned, played_at) -> кадр"""
+    modes: list[str] = []
+    codes: dict[str, int] = {}
+    columns = {name: array(typecode) for name, typecode in COLUMNS}
+    for row in rows:
+        for (name, _), value in zip(COLUMNS, row):
+            if name == "mode":
+                if value not in codes:
+                    codes[value] = len(modes)
+                    modes.append(value)
+                value = codes[value]
+            columns[name].append(value or 0)
+
+    payload = [columns[name].tobytes() for name, _ in COLUMNS]
+    header = json.dumps({
+        "rows": len(rows),
+        "byteorder": sys.byteorder,
+        "modes": modes,
+        "columns": [
+            [name, typecode, len(data)] for (name, typecode), data in zip(COLUMNS, payload)
+        ],
+    }).encode()
+    return struct.pack("<I", len(header)) + header + b"".join(payload)
+
+
+def append_rows(directory: str, rows: list) -> dict:
+    """Дописать строки в сегменты по дням (блокирующая функция — звать через to_thread).
+    Возвращает {день: строк}."""
+    by_day: dict[str, list] = {}
+    for row in rows:
+        day = datetime.fromtimestamp(row[6], timezone.utc).strftime("%Y-%m-%d")
+        by_day.setdefault(day, []).append(row)
+
+    os.makedirs(directory, exist_ok=True)
+    for day, day_rows in by_day.items():
+        with open(segment_path(directory, day), "ab") as f:
+            with gzip.GzipFile(fileobj=f, mode="wb", mtime=0) as gz:
+                gz.write(_encode(day_rows))
+            f.flush()
+            os.fsync(f.fileno())
+    return {day: len(day_rows) for day, day_rows in by_day.items()}
+
+
+# ============ ЧТЕНИЕ ============
+
+def _read_exact(stream, size: int) -> bytes:
+    data = stream.read(size)
+    if len(data) != size:
+        raise EOFError("Truncated archive segment")
+    return data
+
+
+def _iter_frames(path: str):
+    """Кадры одного сегмента: {колонка: array} + "modes" """
+    with gzip.open(path, "rb") as stream:
+        while True:
+            prefix = stream.read(4)
+            if not prefix:
+                return
+            (header_len,) = struct.unpack("<I", prefix)
+            header = json.loads(_read_exact(stream, header_len))
+            frame = {"modes": header["modes"], "rows": header["rows"]}
+            for name, typecode, size in header["columns"]:
+                column = array(typecode)
+                column.frombytes(_read_exact(stream, size))
+                if header["byteorder"] != sys.byteorder:
+                    column.byteswap()
+                frame[name] = column
+            yield frame
+
+
+def archive_dirs(directory: str) -> list:
+    """Каталоги архива: сам directory (однофайловая БД, в т.ч. до шардирования) и shard<N>/"""
+    if not os.path.isdir(directory):
+        return []
+    shards = sorted(
+        (name for name in os.listdir(directory)
+         if name.startswith("shard") and name[5:].isdigit() and os.path.isdir(os.path.join(directory, name))),
+        key=lambda name: int(name[5:]),
+    )
+    return [directory] + [os.path.join(directory, name) for name in shards]
+
+
+def list_segments(directory: str, since: str | None = None, until: str | None = None) -> list:
+    """Сегменты всех каталогов архива (см. archive_dirs), с фильтром по дням [since, until]"""
+    return [path for d in archive_dirs(directory) for path in _dir_segments(d, since, until)]
+
+
+def _dir_segments(directory: str, since: str | None, until: str | None) -> list:
+    """Сегменты одного каталога по возрастанию дня"""
+    days = sorted(
+        name[:-len(SEGMENT_SUFFIX)] for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX)
+    )
+    return [
+        segment_path(directory, day) for day in days
+        if (since is None or day >= since) and (until is None or day <= until)
+    ]
+
+
+def iter_columns(directory: str, since: str | None = None, until: str | None = None):
+    """Потоковое чтение кадров (колоночно) — для агрегатов без построчных словарей"""
+    for path in list_segments(directory, since, until):
+        yield from _iter_frames(path)
+
+
+def iter_rows(directory: str, since: str | None = None, until: str | None = None):
+    """Потоковое чтение строк архива: каталог за каталогом, внутри — по возрастанию id.
+    Повторно дописанные после сбоя кадры (id не растёт) пропускаются."""
+    for d in archive_dirs(directory):
+        yield from _iter_dir_rows(d, since, until)
+
+
+def _iter_dir_new(directory: str, since: str | None, until: str | None):
+    """(путь сегмента, кадр, индекс строки) без повторов.
+    id растут только внутри одного каталога — дубли ищем в его пределах"""
+    last_id = 0
+    for path in _dir_segments(directory, since, until):
+        for frame in _iter_frames(path):
+            ids = frame["id"]
+            for i in range(frame["rows"]):
+                if ids[i] <= last_id:
+                    continue
+                last_id = ids[i]
+                yield path, frame, i
+
+
+def _iter_dir_rows(directory: str, since: str | None, until: str | None):
+    for _, frame, i in _iter_dir_new(directory, since, until):
+        yield {
+            "id": frame["id"][i],
+            "user_id": frame["user_id"][i],
+            "mode": frame["modes"][frame["mode"][i]],
+            "anime_id": frame["anime_id"][i],
+            "was_correct": frame["was_correct"][i],
+            "xp_earned": frame["xp_earned"][i],
+            "played_at": datetime.fromtimestamp(frame["played_at"][i], timezone.utc)
+            .strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+
+def count_rows(directory: str, since: str | None = None, until: str | None = None) -> dict:
+    """{день: строк} по всем каталогам архива — без повторов, как iter_rows"""
+    counts: dict[str, int] = {}
+    for d in archive_dirs(directory):
+        for path, _, _ in _iter_dir_new(d, since, until):
+            day = os.path.basename(path)[:-len(SEGMENT_SUFFIX)]
+            counts[day] = counts.get(day, 0) + 1
+    return dict(sorted(counts.items()))
+
+
+def main():
+    """CLI: выгрузка архива в CSV для офлайн-анализа"""
+    import config
+
+    parser = argparse.ArgumentParser(description="Чтение архива game_history")
+    parser.add_argument("--dir", default=config.HISTORY_ARCHIVE_DIR, help="каталог архива (с подкаталогами shard<N>)")
+    parser.add_argument("--since", help="первый день, YYYY-MM-DD")
+    parser.add_argument("--until", help="последний день, YYYY-MM-DD")
+    parser.add_argument("--count", action="store_true", help="только количество строк по дням")
+    args = parser.parse_args()
+
+    if args.count:
+        # Один день может лежать в нескольких каталогах (шарды, архив до шардирования)
+        for day, rows in count_rows(args.dir, args.since, args.until).items():
+            print(f"{day}\t{rows}")
+        return
+
+    writer = None
+    for row in iter_rows(args.dir, args.since, args.until):
+        if writer is None:
+            writer = csv.DictWriter(sys.stdout, fieldnames=list(row))
+            writer.writeheader()
+        writer.writerow(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""
+🏋️ Нагрузочный тест бота: прогоняет bot.dp на синтетических апдейтах
+
+Telegram Bot API и Jikan подменяются локальными заглушками, база — временный
+SQLite-файл. Виртуальные игроки делают /start, выбирают режим и отвечают
+на вопросы через callback `ans_`. В конце — апдейты/сек, p50/p95/p99
+времени обработки и количество COMMIT в SQLite.
+
+Запуск из корня репозитория:
+    python benchmarks/loadtest.py --users 2000 --rounds 5 --concurrency 200
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123456:LOADTEST")
+
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.exceptions import TelegramBadRequest  # noqa: E402
+from aiogram.methods import Response  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+
+import bot as botmod  # noqa: E402
+import config  # noqa: E402
+import database as db  # noqa: E402
+import metrics  # noqa: E402
+import middlewares  # noqa: E402
+import profiler  # noqa: E402
+
+
+# ============ ЗАГЛУШКА TELEGRAM ============
+
+class FakeSession(BaseSession):
+    """Сессия без сети: отвечает на методы Bot API правдоподобными объектами"""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: dict[str, int] = defaultdict(int)
+        self.message_ids = itertools.count(1)
+        self.messages: dict[tuple[int, int], dict] = {}   # (chat_id, message_id) -> message
+        self.last_message: dict[int, dict] = {}            # chat_id -> последнее сообщение бота
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def make_request(self, bot, method, timeout=None):
+        name = method.__api_method__
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        result = self._handle(name, method)
+        response = Response[method.__returning__].model_validate(
+            {"ok": True, "result": result}, context={"bot": bot}
+        )
+        return response.result
+
+    def _handle(self, name: str, method):
+        if name in ("sendMessage", "sendPhoto"):
+            message = {
+                "message_id": next(self.message_ids),
+                "date": int(time.time()),
+                "chat": {"id": method.chat_id, "type": "private"},
+            }
+            if name == "sendPhoto":
+                message["caption"] = method.caption
+                message["photo"] = [{
+                    "file_id": f"photo-{message['message_id']}",
+                    "file_unique_id": f"u{message['message_id']}",
+                    "width": 225,
+                    "height": 320,
+                }]
+            else:
+                message["text"] = method.text
+            return self._store(method.chat_id, message, method.reply_markup)
+
+        if name in ("editMessageText", "editMessageCaption", "editMessageMedia"):
+            message = self.messages.get((method.chat_id, method.message_id))
+            if message is None:
+                raise TelegramBadRequest(method=method, message="Bad Request: message to edit not found")
+            message = dict(message)
+            if name == "editMessageText":
+                if "photo" in message:
+                    raise TelegramBadRequest(method=method, message="Bad Request: there is no text in the message to edit")
+                message["text"] = method.text
+            elif name == "editMessageCaption":
+                if "photo" not in message:
+                    raise TelegramBadRequest(method=method, message="Bad Request: there is no caption in the message to edit")
+                message["caption"] = method.caption
+            else:
+                if "photo" not in message:
+                    raise TelegramBadRequest(method=method, message="Bad Request: message can't be edited")
+                message["caption"] = method.media.caption
+            return self._store(method.chat_id, message, method.reply_markup)
+
+        if name == "deleteMessage":
+            self.messages.pop((method.chat_id, method.message_id), None)
+            return True
+
+        if name == "getMe":
+            return {"id": 123456, "is_bot": True, "first_name": "LoadTest"}
+
+        return True
+
+    def _store(self, chat_id: int, message: dict, reply_markup) -> dict:
+        if reply_markup is not None:
+            message["reply_markup"] = reply_markup.model_dump(mode="json", exclude_none=True)
+        else:
+            message.pop("reply_markup", None)
+        self.messages[(chat_id, message["message_id"])] = message
+        self.last_message[chat_id] = message
+        return message
+
+
+async def fake_anime_image_url(mal_id: int, latency: float = 0.0) -> str:
+    """Заглушка Jikan: мгновенный (или с задержкой) URL картинки"""
+    if mal_id not in botmod.image_cache:
+        if latency:
+            await asyncio.sleep(latency)
+        botmod.image_cache[mal_id] = f"https://cdn.example/anime/{mal_id}.jpg"
+    return botmod.image_cache[mal_id]
+
+
+# ============ ВИРТУАЛЬНЫЕ ИГРОКИ ============
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.session = FakeSession(latency=args.api_latency / 1000)
+        self.update_ids = itertools.count(1)
+        self.callback_ids = itertools.count(1)
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"Load{user_id}", "username": f"load{user_id}"}
+
+    async def feed(self, kind: str, payload: dict):
+        """Отдать апдейт диспетчеру и замерить время обработки"""
+        update = Update.model_validate(
+            {"update_id": next(self.update_ids), **payload}, context={"bot": botmod.bot}
+        )
+        start = time.perf_counter()
+        try:
+            await botmod.dp.feed_update(botmod.bot, update)
+        except Exception as e:
+            self.errors[type(e).__name__] += 1
+            logging.debug("Update %s failed", kind, exc_info=True)
+        self.latencies[kind].append(time.perf_counter() - start)
+
+    async def send_text(self, user_id: int, text: str, kind: str):
+        await self.feed(kind, {"message": {
+            "message_id": next(self.session.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }})
+
+    async def press(self, user_id: int, data: str, kind: str):
+        message = self.session.last_message.get(user_id)
+        payload = {
+            "id": str(next(self.callback_ids)),
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+        }
+        if message is not None:
+            payload["message"] = message
+        await self.feed(kind, {"callback_query": payload})
+
+    def pick_answer(self, user_id: int) -> str | None:
+        """Выбрать ответ по клавиатуре последнего сообщения"""
+        message = self.session.last_message.get(user_id) or {}
+        buttons = [
+            row[0]["callback_data"]
+            for row in message.get("reply_markup", {}).get("inline_keyboard", [])
+            if row and row[0].get("callback_data", "").startswith("ans_")
+        ]
+        if not buttons:
+            return None
+        _, game_id, _ = buttons[0].split("_")
+        game = botmod.active_games.get(game_id)
+        if game and random.random() < self.args.accuracy:
+            return f"ans_{game_id}_{game['correct_index']}"
+        return random.choice(buttons)
+
+    async def run_user(self, user_id: int):
+        await self.send_text(user_id, "/start", "start")
+        await self.press(user_id, "play", "menu")
+        mode = random.choice(["gm_i", "gm_q", "gm_r"])
+        for _ in range(self.args.rounds):
+            await self.press(user_id, mode, "start_game")
+            answer = self.pick_answer(user_id)
+            if answer is None:
+                self.errors["NoQuestion"] += 1
+                continue
+            if self.args.think_time:
+                await asyncio.sleep(random.uniform(0, self.args.think_time / 1000))
+            await self.press(user_id, answer, "answer")
+
+    async def run(self) -> dict:
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        base_id = 10_000_000
+
+        async def guarded(user_id: int):
+            async with semaphore:
+                await self.run_user(user_id)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(guarded(base_id + i) for i in range(self.args.users)))
+        return {"wall_time": time.perf_counter() - start}
+
+
+# ============ ОТЧЁТ ============
+
+def percentile(sorted_values: list, pct: float) -> float:
+    """Перцентиль методом ближайшего ранга"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: list) -> dict:
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": (values[-1] * 1000) if values else 0.0,
+    }
+
+
+async def main_async(args) -> dict:
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix="anime-loadtest-")
+    db.DATABASE_PATH = os.path.join(workdir, "loadtest.db")
+
+    test = LoadTest(args)
+    botmod.bot.session = test.session
+
+    async def image_url(mal_id: int):
+        return await fake_anime_image_url(mal_id, args.jikan_latency / 1000)
+
+    botmod.get_anime_image_url = image_url
+
+    # У заглушки нет лимитов Telegram — по умолчанию планировщик их не применяет
+    config.TG_RATE, config.TG_CHAT_RATE = args.tg_rate, args.tg_chat_rate
+    if args.admission_limit is not None:
+        botmod.admission.limit = args.admission_limit
+    await botmod.on_startup()
+    commits_before = metrics.DB_COMMITS.get()
+    sampler = None
+    if args.profile:
+        sampler = profiler.SamplingProfiler(interval=args.profile_interval / 1000)
+        sampler.start()
+    try:
+        run = await test.run()
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        await botmod.on_shutdown()
+
+    if sampler is not None:
+        sampler.write_collapsed(args.profile)
+        print(sampler.summary())
+        print(f"🔥 Collapsed stacks: {args.profile}")
+        print()
+
+    commits = metrics.DB_COMMITS.get() - commits_before
+    all_latencies = [v for values in test.latencies.values() for v in values]
+    total_updates = len(all_latencies)
+    return {
+        "users": args.users,
+        "rounds": args.rounds,
+        "concurrency": args.concurrency,
+        "updates": total_updates,
+        "errors": dict(test.errors),
+        "wall_time_s": run["wall_time"],
+        "updates_per_sec": total_updates / run["wall_time"] if run["wall_time"] else 0.0,
+        "latency": summarize(all_latencies),
+        "handlers": {kind: summarize(values) for kind, values in sorted(test.latencies.items())},
+        "sqlite_commits": commits,
+        "commits_per_update": commits / total_updates if total_updates else 0.0,
+        "api_calls": dict(sorted(test.session.calls.items())),
+        "shed": {"/".join(key): int(count) for key, count in sorted(middlewares.ADMISSION_SHED.values.items())},
+    }
+
+
+def print_report(report: dict):
+    print(f"👥 Игроков: {report['users']} × {report['rounds']} раундов, параллельно {report['concurrency']}")
+    print(f"📨 Апдейтов: {report['updates']} за {report['wall_time_s']:.2f} с "
+          f"→ {report['updates_per_sec']:.1f} апд/с (ошибок: {sum(report['errors'].values())})")
+    if report["errors"]:
+        print(f"⚠️ Ошибки: {report['errors']}")
+    print(f"💾 SQLite COMMIT: {report['sqlite_commits']} ({report['commits_per_update']:.2f} на апдейт)")
+    print(f"📡 Bot API: {report['api_calls']}")
+    if report["shed"]:
+        print(f"🚦 Отброшено при перегрузке: {report['shed']}")
+    print()
+    print(f"{'обработчик':<12} {'кол-во':>8} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9} {'max мс':>9}")
+    rows = list(report["handlers"].items()) + [("ВСЕГО", report["latency"])]
+    for kind, stats in rows:
+        print(f"{kind:<12} {stats['count']:>8} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} "
+              f"{stats['p99_ms']:>9.2f} {stats['max_ms']:>9.2f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест диспетчера бота")
+    parser.add_argument("--users", type=int, default=1000, help="число виртуальных игроков")
+    parser.add_argument("--rounds", type=int, default=5, help="вопросов на игрока")
+    parser.add_argument("--concurrency", type=int, default=100, help="игроков одновременно")
+    parser.add_argument("--accuracy", type=float, default=0.6, help="доля правильных ответов")
+    parser.add_argument("--think-time", type=float, default=0.0, help="пауза перед ответом, мс (макс.)")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка Bot API, мс")
+    parser.add_argument("--jikan-latency", type=float, default=0.0, help="задержка Jikan при промахе кеша, мс")
+    parser.add_argument("--tg-rate", type=float, default=0.0, help="лимит вызовов Bot API в секунду (0 — без)")
+    parser.add_argument("--tg-chat-rate", type=float, default=0.0, help="лимит вызовов в секунду на чат (0 — без)")
+    parser.add_argument("--admission-limit", type=int, help="обработчиков одновременно (по умолчанию — из config, 0 — без)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="сохранить отчёт в JSON-файл")
+    parser.add_argument("--profile", help="снять сэмплирующий профиль в collapsed-файл")
+    parser.add_argument("--profile-interval", type=float, default=5.0, help="интервал сэмплирования, мс")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING)
+    report = asyncio.run(main_async(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+⏱ Микробенчмарки горячих CPU-путей бота (без сети и без диска)
+
+Каждая функция меряется на синтетических каталогах разного размера,
+чтобы было видно, как она масштабируется. Загрузка снимка игрока
+(load_snapshot) гоняется против SQLite в памяти. Результаты можно сохранить в JSON и сравнить
+с прогоном на другом коммите.
+
+Запуск из корня репозитория:
+    python benchmarks/micro.py --json micro.json
+    python benchmarks/micro.py --compare micro.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BOT_TOKEN", "123456:MICROBENCH")
+
+import aiosqlite  # noqa: E402
+
+import anime_data  # noqa: E402
+import bot as botmod  # noqa: E402
+import database as db  # noqa: E402
+import playerstate  # noqa: E402
+from anime_data import (  # noqa: E402
+    ANIME_LIST, ACHIEVEMENT_IDS, RARITY_COMMON, RARITY_RARE, RARITY_EPIC, RARITY_LEGENDARY,
+)
+
+DEFAULT_SIZES = [len(ANIME_LIST), 1_000, 10_000, 50_000]
+MEMORY_DB = "file:anime_micro_bench?mode=memory&cache=shared"
+
+
+# ============ СИНТЕТИЧЕСКИЙ КАТАЛОГ ============
+
+def make_catalog(size: int, seed: int = 1) -> list:
+    """Каталог заданного размера с тем же распределением редкостей"""
+    rng = random.Random(seed)
+    rarities = (
+        [RARITY_COMMON] * 40 + [RARITY_RARE] * 30 + [RARITY_EPIC] * 20 + [RARITY_LEGENDARY] * 10
+    )
+    catalog = []
+    for i in range(1, size + 1):
+        catalog.append({
+            "id": i,
+            "mal_id": 100_000 + i,
+            "name": f"Synthetic Anime {i}",
+            "name_ru": f"Синтетическое аниме {i}",
+            "rarity": rng.choice(rarities),
+            "quotes": [
+                {"text": f"Цитата {i}-{q}", "character": f"Персонаж {i}"}
+                for q in range(rng.randint(0, 3))
+            ],
+        })
+    return catalog
+
+
+def use_catalog(catalog: list):
+    """Подменить каталог на месте (все модули держат ссылку на тот же список)"""
+    ANIME_LIST[:] = catalog
+    anime_data.reindex_catalog()
+
+
+# ============ ЗАМЕРЫ ============
+
+def bench(func, min_time: float = 0.2, repeat: int = 5) -> dict:
+    """Лучшее и медианное время одного вызова (как timeit.autorange)"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1_000_000:
+            break
+        number *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number)
+    timings.sort()
+    return {"best_us": timings[0] * 1e6, "median_us": timings[len(timings) // 2] * 1e6, "loops": number}
+
+
+async def bench_async(make_coro, min_time: float = 0.2, repeat: int = 5) -> dict:
+    """То же для корутин (каждая итерация — отдельный await)"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            await make_coro()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 100_000:
+            break
+        number *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            await make_coro()
+        timings.append((time.perf_counter() - start) / number)
+    timings.sort()
+    return {"best_us": timings[0] * 1e6, "median_us": timings[len(timings) // 2] * 1e6, "loops": number}
+
+
+def cpu_benchmarks(size: int) -> dict:
+    """Чистые CPU-функции на текущем каталоге"""
+    rng = random.Random(size)
+    results = {}
+
+    for mode in ("image", "quote"):
+        def run_create_game(mode=mode):
+            game_id, _ = botmod.create_game(1, mode)
+            botmod.active_games.discard(game_id)
+        results[f"create_game[{mode}]"] = bench(run_create_game)
+
+    game_id, game = botmod.create_game(1, "image")
+    botmod.active_games.discard(game_id)
+    results["get_options_keyboard"] = bench(lambda: botmod.get_options_keyboard("deadbeef", game["options"]))
+
+    player = {
+        "correct_answers": 40, "wrong_answers": 5, "streak": 3, "max_streak": 12, "games_played": 45,
+        "correct_by_image": 30, "correct_by_quote": 10, "daily_streak": 4, "collection_count": 40,
+        "xp": 0, "achievements_count": 0,
+    }
+    collection = {a["id"] for a in rng.sample(ANIME_LIST, min(40, len(ANIME_LIST)))}
+    snapshot = playerstate.PlayerSnapshot(player, set(), collection)
+    botmod.check_achievements(snapshot)  # первый прогон открывает достижения
+    extra = {"speed_answer": True, "guessed_legendary": False}
+    results["check_achievements[snapshot]"] = bench(lambda: botmod.check_achievements(snapshot, extra))
+
+    new_achs = rng.sample(ACHIEVEMENT_IDS, 3)
+    results["format_new_achievements"] = bench(lambda: botmod.format_new_achievements(new_achs))
+
+    xps = [rng.randint(0, 30_000) for _ in range(1000)]
+    results["get_xp_progress[x1000]"] = bench(lambda: [anime_data.get_xp_progress(xp) for xp in xps])
+
+    pages = botmod.get_collection_pages()
+    page = pages // 2 + 1
+    start = (page - 1) * botmod.COLLECTION_PER_PAGE
+    guessed = {a["id"]: 2 for a in ANIME_LIST[start:start + botmod.COLLECTION_PER_PAGE:2]}
+    results["render_collection_page"] = bench(lambda: botmod.render_collection_page(page, guessed, len(guessed)))
+
+    return results
+
+
+async def db_benchmarks(size: int) -> dict:
+    """Загрузка снимка игрока против SQLite в памяти"""
+    db.DATABASE_PATH = MEMORY_DB
+    # Держим одно соединение открытым, иначе база в памяти исчезнет
+    async with aiosqlite.connect(MEMORY_DB, uri=True) as anchor:
+        await db.init_db()
+        user_id = 777
+        await db.create_player(user_id, "bench", "Bench")
+        for anime in random.Random(size).sample(ANIME_LIST, min(40, len(ANIME_LIST))):
+            await db.record_correct_answer(user_id, "image", anime["id"], 10)
+        await db.unlock_achievements(
+            user_id, {ach_id: anime_data.ACHIEVEMENTS[ach_id]["reward_xp"] for ach_id in ("first_win", "correct_10")}
+        )
+
+        results = {
+            "load_snapshot[sqlite:memory]": await bench_async(lambda: botmod.load_snapshot(user_id))
+        }
+        for table in ("players", "collection", "achievements", "game_history"):
+            await anchor.execute(f"DROP TABLE IF EXISTS {table}")
+        await anchor.commit()
+    return results
+
+
+# ============ ОТЧЁТ ============
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def run(sizes: list, with_db: bool = True) -> dict:
+    original = list(ANIME_LIST)
+    results = []
+    try:
+        for size in sizes:
+            use_catalog(original if size == len(original) else make_catalog(size))
+            measured = cpu_benchmarks(size)
+            if with_db:
+                measured.update(asyncio.run(db_benchmarks(size)))
+            for name, stats in measured.items():
+                results.append({"name": name, "catalog": size, **stats})
+                print(f"{name:<36} {size:>7} {stats['best_us']:>12.2f} {stats['median_us']:>12.2f}", flush=True)
+    finally:
+        use_catalog(original)
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline_path: str):
+    """Сравнить с сохранённым прогоном (по медиане)"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    old = {(r["name"], r["catalog"]): r for r in baseline["results"]}
+    print()
+    print(f"Сравнение с {baseline.get('commit', '?')} → {report['commit']}")
+    print(f"{'функция':<36} {'каталог':>7} {'было мкс':>12} {'стало мкс':>12} {'×':>7}")
+    for r in report["results"]:
+        prev = old.get((r["name"], r["catalog"]))
+        if not prev:
+            continue
+        ratio = r["median_us"] / prev["median_us"] if prev["median_us"] else float("inf")
+        print(f"{r['name']:<36} {r['catalog']:>7} {prev['median_us']:>12.2f} {r['median_us']:>12.2f} {ratio:>7.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Микробенчмарки горячих путей")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="размеры каталога через запятую")
+    parser.add_argument("--no-db", action="store_true", help="без замеров load_snapshot")
+    parser.add_argument("--json", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    print(f"{'функция':<36} {'каталог':>7} {'лучшее мкс':>12} {'медиана мкс':>12}")
+    report = run(sizes, with_db=not args.no_db)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
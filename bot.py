@@ -4,11 +4,14 @@
 Система: XP, ранги, достижения, коллекция, топ игроков
 """
 import asyncio
+import html
 import logging
+import os
 import random
 import time
-import uuid
-from datetime import datetime
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import lru_cache
 
 import aiohttp
 from aiogram import Bot, Dispatcher, types, F
@@ -19,10 +22,21 @@ from aiogram.client.default import DefaultBotProperties
 
 import config
 import database as db
+import gamestore
+import loopmon
+import metrics
+import middlewares
+import outbound
+import playerstate
+import profiler
+import selection
+import timerwheel
+import tracing
+import transport
 from anime_data import (
     ANIME_LIST, ACHIEVEMENTS, RARITY_EMOJI, RARITY_NAMES, RARITY_POINTS,
-    get_rank, get_next_rank, get_xp_progress, get_anime_by_id, get_anime_with_quotes,
-    get_all_rarities_set, RARITY_COMMON, RARITY_RARE, RARITY_EPIC, RARITY_LEGENDARY,
+    get_rank, get_next_rank, get_xp_progress, ranks_for, get_anime_by_id,
+    get_all_rarities_set, get_achievements_mask, RARITY_LEGENDARY,
 )
 
 # Настройка логирования
@@ -35,68 +49,109 @@ bot = Bot(
     default=DefaultBotProperties(parse_mode=ParseMode.HTML)
 )
 dp = Dispatcher()
+screens = transport.MessageTransport(bot)   # Смена экранов одним вызовом API
 
 # ============ ИГРОВОЕ СОСТОЯНИЕ (В ПАМЯТИ) ============
-active_games: dict[str, dict] = {}      # game_id -> game_data
+game_timers = timerwheel.TimingWheel(tick=config.GAME_TIMER_TICK)  # Таймауты открытых игр
+active_games = gamestore.GameStore(game_timers)  # game_id -> game_data
 image_cache: dict[int, str] = {}         # mal_id -> image_url
+photo_file_ids: dict[int, str] = {}      # mal_id -> file_id уже отправленной картинки
+prepared_games: OrderedDict[int, dict] = OrderedDict()  # user_id -> заготовленная следующая игра
 jikan_semaphore = asyncio.Semaphore(3)   # Лимит параллельных запросов к Jikan
+background_tasks: set[asyncio.Task] = set()  # Фоновые задачи (держим ссылки)
+metrics_runner = None                     # HTTP-сервер /metrics (если включён)
+outbound_scheduler: outbound.OutboundScheduler | None = None  # Лимиты исходящих вызовов (в on_startup)
+active_profiler: profiler.SamplingProfiler | None = None  # Идущее профилирование (/sample)
+player_writes = playerstate.UserWriteQueue()  # Фоновая запись ответов в БД (по порядку на игрока)
+loop_monitor = loopmon.LoopMonitor(
+    interval=config.LOOP_MONITOR_INTERVAL_MS / 1000,
+    stall_threshold=config.LOOP_STALL_MS / 1000,
+)
 
 
-# ============ ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ============
+def outbound_priority(event) -> int:
+    """Приоритет исходящих вызовов обработчика: результат ответа > новый вопрос > остальное"""
+    data = getattr(event, "data", None) or ""
+    if data.startswith("ans_"):
+        return outbound.PRIORITY_ANSWER
+    if data.startswith("gm_"):
+        return outbound.PRIORITY_GAME
+    return outbound.PRIORITY_VIEW
+
+
+metrics.ACTIVE_GAMES.set_function(lambda: len(active_games))
+if config.TRACE_SLOW_MS > 0:
+    # Первым в цепочке: ожидание в ящике игрока и в очереди допуска входит в трассу
+    dp.update.outer_middleware(tracing.UpdateTracingMiddleware(config.TRACE_SLOW_MS / 1000))
+dp.update.outer_middleware(middlewares.DedupeMiddleware())
+dp.update.outer_middleware(middlewares.UserMailboxMiddleware())
+admission = middlewares.AdmissionMiddleware(
+    lambda update: outbound_priority(update.event),
+    limit=config.ADMISSION_LIMIT, queue_sizes=config.ADMISSION_QUEUES,
+    class_names=("answer", "game", "view"),
+    max_wait=config.ADMISSION_MAX_WAIT, busy_text=config.TEXTS["busy"],
+)
+dp.update.outer_middleware(admission)
+dp.callback_query.middleware(outbound.OutboundPriorityMiddleware(outbound_priority))
+dp.message.middleware(metrics.HandlerMetricsMiddleware())
+dp.callback_query.middleware(metrics.HandlerMetricsMiddleware())
+if config.TRACE_SLOW_MS > 0:
+    dp.message.middleware(tracing.HandlerTracingMiddleware())
+    dp.callback_query.middleware(tracing.HandlerTracingMiddleware())
 
-def cleanup_old_games():
-    """Удалить устаревшие игры из памяти"""
-    now = time.time()
-    expired = [gid for gid, g in active_games.items() if now - g["created_at"] > 120]
-    for gid in expired:
-        del active_games[gid]
 
+# ============ ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ============
 
 async def get_anime_image_url(mal_id: int) -> str | None:
     """Получить URL картинки аниме через Jikan API (с кешем)"""
     if mal_id in image_cache:
+        metrics.IMAGE_CACHE.inc(result="hit")
         return image_cache[mal_id]
+    metrics.IMAGE_CACHE.inc(result="miss")
 
-    async with jikan_semaphore:
-        try:
-            async with aiohttp.ClientSession() as session:
-                url = f"{config.JIKAN_BASE_URL}/anime/{mal_id}"
-                async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        img_url = data["data"]["images"]["jpg"]["large_image_url"]
-                        image_cache[mal_id] = img_url
-                        return img_url
-                    elif resp.status == 429:
-                        # Rate limited — подождём
-                        await asyncio.sleep(2)
-                        return await get_anime_image_url(mal_id)
-        except Exception as e:
-            logger.error(f"Jikan API error for mal_id={mal_id}: {e}")
+    with tracing.span("jikan", mal_id=mal_id) as span:
+        async with jikan_semaphore:
+            start = time.perf_counter()
+            try:
+                async with aiohttp.ClientSession() as session:
+                    url = f"{config.JIKAN_BASE_URL}/anime/{mal_id}"
+                    async with session.get(url, timeout=aiohttp.ClientTimeout(total=10)) as resp:
+                        metrics.JIKAN_LATENCY.observe(time.perf_counter() - start)
+                        metrics.JIKAN_RESPONSES.inc(status=resp.status)
+                        if span is not None:
+                            span.attrs["status"] = resp.status
+                        if resp.status == 200:
+                            data = await resp.json()
+                            img_url = data["data"]["images"]["jpg"]["large_image_url"]
+                            image_cache[mal_id] = img_url
+                            return img_url
+                        elif resp.status == 429:
+                            # Rate limited — подождём
+                            await asyncio.sleep(2)
+                            return await get_anime_image_url(mal_id)
+            except Exception as e:
+                metrics.JIKAN_RESPONSES.inc(status="error")
+                logger.error(f"Jikan API error for mal_id={mal_id}: {e}")
 
     return None
 
 
-def create_game(user_id: int, mode: str) -> tuple[str, dict]:
-    """Создать новую игру и вернуть (game_id, game_data)"""
-    cleanup_old_games()
+async def resolve_photo(mal_id: int, warm: asyncio.Task | None = None) -> str | None:
+    """Что отправить как фото: file_id уже отправленной картинки или её URL.
+    warm — идущий прогрев URL (дожидаемся его, а не шлём второй запрос в Jikan)"""
+    if mal_id in photo_file_ids:
+        return photo_file_ids[mal_id]
+    if warm is not None:
+        await asyncio.wait([warm])
+    return await get_anime_image_url(mal_id)
 
-    # Выбираем аниме
-    if mode == "quote":
-        pool = get_anime_with_quotes()
-    else:
-        pool = ANIME_LIST.copy()
 
-    correct_anime = random.choice(pool)
-
-    # Выбираем неправильные варианты (из той же редкости или близкой)
-    wrong_pool = [a for a in ANIME_LIST if a["id"] != correct_anime["id"]]
-    # Приоритет — аниме той же редкости
-    same_rarity = [a for a in wrong_pool if a["rarity"] == correct_anime["rarity"]]
-    if len(same_rarity) >= config.OPTIONS_COUNT - 1:
-        wrong_choices = random.sample(same_rarity, config.OPTIONS_COUNT - 1)
-    else:
-        wrong_choices = random.sample(wrong_pool, min(config.OPTIONS_COUNT - 1, len(wrong_pool)))
+def build_game(user_id: int, mode: str, skill: int = 0) -> dict:
+    """Собрать данные игры (без регистрации в active_games).
+    skill — уровень игрока (selection.skill_band), от него зависит сложность вопроса"""
+    # Аниме и неправильные варианты — из alias-таблиц движка подбора
+    correct_anime = selection.engine.pick_question(mode, skill)
+    wrong_choices = selection.engine.pick_distractors(correct_anime, config.OPTIONS_COUNT - 1, skill)
 
     # Формируем варианты ответа
     options = wrong_choices + [correct_anime]
@@ -108,8 +163,7 @@ def create_game(user_id: int, mode: str) -> tuple[str, dict]:
     if mode == "quote" and correct_anime.get("quotes"):
         quote = random.choice(correct_anime["quotes"])
 
-    game_id = str(uuid.uuid4())[:8]
-    game_data = {
+    return {
         "user_id": user_id,
         "mode": mode,
         "correct_anime": correct_anime,
@@ -118,8 +172,103 @@ def create_game(user_id: int, mode: str) -> tuple[str, dict]:
         "quote": quote,
         "created_at": time.time(),
     }
-    active_games[game_id] = game_data
-    return game_id, game_data
+
+
+def create_game(user_id: int, mode: str, skill: int = 0) -> tuple[str, dict]:
+    """Создать новую игру и вернуть (game_id, game_data)"""
+    game_data = build_game(user_id, mode, skill)
+    return active_games.open(game_data, config.GAME_TIMEOUT), game_data
+
+
+# ============ ЗАГОТОВКА СЛЕДУЮЩЕЙ ИГРЫ ============
+
+def prepare_next_game(user_id: int, mode: str, skill: int = 0):
+    """После ответа заранее собрать следующую игру того же режима и прогреть картинку"""
+    game_data = build_game(user_id, mode, skill)
+    warm = None
+    if mode == "image":
+        mal_id = game_data["correct_anime"]["mal_id"]
+        if mal_id not in photo_file_ids and mal_id not in image_cache:
+            warm = start_background_task(get_anime_image_url(mal_id))
+
+    # Одна заготовка на игрока; порядок вставки = порядок истечения TTL
+    prepared_games.pop(user_id, None)
+    prepared_games[user_id] = {
+        "game": game_data,
+        "warm": warm,
+        "expires_at": time.monotonic() + config.PREPARED_GAME_TTL,
+    }
+    while len(prepared_games) > config.PREPARED_GAMES_MAX:
+        prepared_games.popitem(last=False)
+
+
+def take_prepared_game(user_id: int, mode: str) -> tuple | None:
+    """Забрать заготовку игрока и зарегистрировать игру: (game_id, game_data, warm).
+    None — заготовки нет, она устарела или другого режима"""
+    now = time.monotonic()
+    while prepared_games and next(iter(prepared_games.values()))["expires_at"] <= now:
+        prepared_games.popitem(last=False)
+        metrics.PREPARED_GAMES.inc(result="expired")
+
+    prepared = prepared_games.pop(user_id, None)
+    if prepared is None:
+        metrics.PREPARED_GAMES.inc(result="miss")
+        return None
+    game_data = prepared["game"]
+    if game_data["mode"] != mode:
+        metrics.PREPARED_GAMES.inc(result="other_mode")
+        return None
+    metrics.PREPARED_GAMES.inc(result="hit")
+
+    game_data["created_at"] = time.time()   # Время на ответ — с показа вопроса
+    return active_games.open(game_data, config.GAME_TIMEOUT), game_data, prepared["warm"]
+
+
+# ============ ТАЙМАУТЫ ИГР ============
+
+def on_game_timeouts(fired: list):
+    """Колбэк колеса таймеров: закрыть просроченные игры одной пачкой"""
+    games = active_games.expire(game_id for game_id, _ in fired)
+    if games:
+        metrics.GAME_TIMEOUTS.inc(len(games))
+        start_background_task(expire_games(games))
+
+
+async def expire_games(games: list):
+    """Сбросить серии (одной записью в БД) и показать «Время вышло!» на месте вопросов"""
+    user_ids = {game["user_id"] for game in games}
+    for user_id in user_ids:
+        snapshot = player_cache.peek(user_id)
+        if snapshot is not None:
+            snapshot.player["streak"] = 0
+
+    def on_failure():
+        for user_id in user_ids:
+            player_cache.invalidate(user_id)
+    # Пачка встаёт в очереди записи каждого игрока — порядок с ответами сохраняется
+    player_writes.submit_many(user_ids, lambda: db.reset_streaks(list(user_ids)), on_failure)
+
+    edits = []
+    for game in games:
+        if "message" not in game:
+            continue    # Вопрос так и не показали
+        anime = game["correct_anime"]
+        text = config.TEXTS["game_timeout"].format(anime_name=f"{anime['name_ru']} ({anime['name']})")
+        message_id, kind = game["message"]
+        edits.append(screens.replace(
+            game["user_id"], message_id, kind, text, get_play_again_keyboard(game["mode"]), keep_photo=True
+        ))
+    results = await asyncio.gather(*edits, return_exceptions=True)
+    failed = sum(isinstance(r, Exception) for r in results)
+    if failed:
+        logger.warning(f"Game timeout: {failed}/{len(edits)} messages not updated")
+
+
+def remember_question(game_data: dict, sent: types.Message | None):
+    """Запомнить сообщение с вопросом — его правим по таймауту"""
+    kind = transport.message_kind(sent)
+    if kind is not None:
+        game_data["message"] = (sent.message_id, kind)
 
 
 def get_options_keyboard(game_id: str, options: list) -> InlineKeyboardMarkup:
@@ -168,13 +317,23 @@ def get_play_again_keyboard(mode: str) -> InlineKeyboardMarkup:
     ])
 
 
-async def ensure_player(user: types.User):
-    """Убедиться, что игрок существует в БД"""
-    player = await db.get_player(user.id)
-    if not player:
-        await db.create_player(user.id, user.username or "", user.first_name or "Игрок")
-    else:
-        await db.update_player_info(user.id, user.username or "", user.first_name or "Игрок")
+async def ensure_player(user: types.User) -> dict | None:
+    """Убедиться, что игрок существует в БД. Возвращает его данные из снимка (None — только что создан).
+    Апдейты игрока идут по очереди (UserMailboxMiddleware), так что снимку можно верить без перечитывания"""
+    username, first_name = user.username or "", user.first_name or "Игрок"
+    snapshot = await player_cache.get(user.id)
+    if snapshot is None:
+        await db.create_player(user.id, username, first_name)
+        return None
+
+    player = snapshot.player
+    if (player["username"], player["first_name"]) != (username, first_name):
+        player["username"], player["first_name"] = username, first_name
+        player_writes.submit(
+            user.id, lambda: db.update_player_info(user.id, username, first_name),
+            lambda: player_cache.invalidate(user.id),
+        )
+    return player
 
 
 async def check_daily_bonus(user_id: int) -> str:
@@ -182,89 +341,70 @@ async def check_daily_bonus(user_id: int) -> str:
     result = await db.check_and_update_daily(user_id)
     if not result:
         return ""
+    snapshot = player_cache.peek(user_id)
+    if snapshot is not None:
+        # Те же изменения, что в БД: XP прибавляется, так что фоновые записи ответов не мешают
+        snapshot.player["daily_streak"] = result["daily_streak"]
+        snapshot.player["last_daily"] = result["last_daily"]
+        snapshot.player["xp"] += result["bonus_xp"]
 
     daily_streak = result["daily_streak"]
-    bonus_xp = config.DAILY_BONUS_XP
 
-    # Бонус за серию дней
+    # Бонус за серию дней (XP уже начислен в БД)
     streak_bonus = ""
-    if daily_streak >= 7:
-        bonus_xp += 50
-        streak_bonus = "\n🎁 Бонус за 7+ дней: +50 XP"
-    elif daily_streak >= 3:
-        bonus_xp += 15
-        streak_bonus = "\n🎁 Бонус за 3+ дней: +15 XP"
-
-    await db.add_xp(user_id, bonus_xp)
+    for days, xp in config.DAILY_STREAK_BONUSES:
+        if daily_streak >= days:
+            streak_bonus = f"\n🎁 Бонус за {days}+ дней: +{xp} XP"
+            break
 
     return config.TEXTS["daily_bonus"].format(
-        xp=bonus_xp,
+        xp=result["bonus_xp"],
         daily_streak=daily_streak,
         streak_bonus=streak_bonus
     )
 
 
-async def check_achievements(user_id: int, extra: dict = None) -> list:
-    """Проверить и разблокировать достижения. Возвращает список новых."""
-    player = await db.get_player(user_id)
-    if not player:
-        return []
-
-    new_achievements = []
-    extra = extra or {}
-
-    # Карта проверок
-    checks = {
-        "first_win": player["correct_answers"] >= 1,
-        "correct_10": player["correct_answers"] >= 10,
-        "correct_50": player["correct_answers"] >= 50,
-        "correct_100": player["correct_answers"] >= 100,
-        "correct_200": player["correct_answers"] >= 200,
-        "streak_5": player["max_streak"] >= 5,
-        "streak_10": player["max_streak"] >= 10,
-        "streak_20": player["max_streak"] >= 20,
-        "games_10": player["games_played"] >= 10,
-        "games_100": player["games_played"] >= 100,
-        "games_500": player["games_played"] >= 500,
-        "image_25": player["correct_by_image"] >= 25,
-        "image_50": player["correct_by_image"] >= 50,
-        "quote_25": player["correct_by_quote"] >= 25,
-        "quote_50": player["correct_by_quote"] >= 50,
-        "daily_3": player["daily_streak"] >= 3,
-        "daily_7": player["daily_streak"] >= 7,
-        "daily_30": player["daily_streak"] >= 30,
-        "speed_demon": extra.get("speed_answer", False),
-        "legendary_guess": extra.get("guessed_legendary", False),
-    }
+async def load_snapshot(user_id: int) -> playerstate.PlayerSnapshot | None:
+    """Загрузить снимок игрока из БД (для кеша снимков)"""
+    row = await db.get_player_snapshot(user_id)
+    return playerstate.PlayerSnapshot(*row) if row else None
+
+
+player_cache = playerstate.SnapshotCache(load_snapshot, player_writes)
+
+
+def check_achievements(snapshot: playerstate.PlayerSnapshot, extra: dict = None) -> dict:
+    """Проверить достижения по снимку игрока и открыть новые в нём.
+    Возвращает {achievement_id: reward_xp} — для записи в БД."""
+    new_achievements = playerstate.evaluate_achievements(
+        snapshot.player, snapshot.achievements, snapshot.rarities, extra
+    )
+    return snapshot.unlock(new_achievements)
 
-    # Проверка коллекции
-    collection_count = await db.get_collection_count(user_id)
-    checks["collect_10"] = collection_count >= 10
-    checks["collect_30"] = collection_count >= 30
-    checks["collect_50"] = collection_count >= 50
-
-    # Проверка всех редкостей
-    collected_rarities = await db.get_collection_rarities(user_id)
-    all_rarities = {RARITY_COMMON, RARITY_RARE, RARITY_EPIC, RARITY_LEGENDARY}
-    checks["all_rarities"] = collected_rarities >= all_rarities
-
-    # Безупречный — 10+ игр, 100% точность
-    total = player["correct_answers"] + player["wrong_answers"]
-    if total >= 10 and player["wrong_answers"] == 0:
-        checks["perfect_10"] = True
+
+def persist_answer(user_id: int, mode: str, anime_id: int, correct: bool, xp_earned: int, rewards: dict):
+    """Записать ответ и открытые достижения в фоне. При окончательной ошибке
+    снимок сбрасывается — следующий ответ перечитает игрока из БД."""
+    def on_failure():
+        player_cache.invalidate(user_id)
+
+    if correct:
+        player_writes.submit(
+            user_id, lambda: db.record_correct_answer(user_id, mode, anime_id, xp_earned), on_failure
+        )
     else:
-        checks["perfect_10"] = False
+        player_writes.submit(user_id, lambda: db.record_wrong_answer(user_id, mode, anime_id), on_failure)
+    if rewards:
+        # unlock_achievements пропускает уже открытые — повтор безопасен
+        player_writes.submit(user_id, lambda: db.unlock_achievements(user_id, rewards), on_failure)
 
-    # Разблокируем
-    for ach_id, condition in checks.items():
-        if condition and ach_id in ACHIEVEMENTS:
-            unlocked = await db.unlock_achievement(user_id, ach_id)
-            if unlocked:
-                reward_xp = ACHIEVEMENTS[ach_id]["reward_xp"]
-                await db.add_xp(user_id, reward_xp)
-                new_achievements.append(ach_id)
 
-    return new_achievements
+def rollover_cached_streaks():
+    """Сбросить прерванные ежедневные серии в снимках (как rollover_daily_streaks в БД)"""
+    yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    for snapshot in player_cache.snapshots():
+        if snapshot.player["last_daily"] < yesterday:
+            snapshot.player["daily_streak"] = 0
 
 
 def format_new_achievements(achievement_ids: list) -> str:
@@ -278,6 +418,29 @@ def format_new_achievements(achievement_ids: list) -> str:
     return "\n".join(lines)
 
 
+# Строки экрана достижений собираются один раз: (закрыто, открыто)
+ACHIEVEMENT_LINES = [
+    (
+        f"🔒 {ach['icon']} <b>{ach['name']}</b> — {ach['description']}",
+        f"✅ {ach['icon']} <b>{ach['name']}</b> — {ach['description']}",
+    )
+    for ach in ACHIEVEMENTS.values()
+]
+
+
+@lru_cache(maxsize=1024)
+def render_achievements(mask: int) -> str:
+    """Текст экрана достижений по битовой маске открытых (с кешем)"""
+    entries = "\n".join(
+        lines[(mask >> i) & 1] for i, lines in enumerate(ACHIEVEMENT_LINES)
+    )
+    return config.TEXTS["achievements_header"].format(
+        unlocked=mask.bit_count(),
+        total=len(ACHIEVEMENTS),
+        entries=entries
+    )
+
+
 # ============ КОМАНДЫ ============
 
 @dp.message(CommandStart())
@@ -342,12 +505,93 @@ async def cmd_stats(message: types.Message):
     if message.from_user.id != config.ADMIN_ID:
         return
     stats = await db.get_bot_stats()
-    await message.answer(
-        f"📊 <b>Статистика бота</b>\n\n"
-        f"👥 Игроков: {stats['total_players']}\n"
-        f"📈 Активных сегодня: {stats['active_today']}\n"
-        f"🎮 Всего игр: {stats['total_games']}\n"
-        f"✅ Правильных ответов: {stats['total_correct']}"
+    active = stats["active"]
+    apm = stats["answers_per_minute"]
+    lines = [
+        "📊 <b>Статистика бота</b>",
+        "",
+        f"👥 Игроков: {stats['total_players']}",
+        f"📈 Активных: {active['1h']} за час • {active['24h']} за сутки • {active['7d']} за неделю",
+        f"🎮 Всего игр: {stats['total_games']}",
+        f"✅ Правильных ответов: {stats['total_correct']}",
+        f"⚡ Ответов в минуту: {apm['last_minute']} (среднее за час {apm['avg_1h']:.1f})",
+        "",
+        "🎯 <b>Точность по режимам:</b>",
+    ]
+    mode_names = {"image": "🖼 По картинке", "quote": "💬 По цитате"}
+    for mode, item in stats["modes"].items():
+        lines.append(f"{mode_names.get(mode, mode)}: {item['accuracy']}% из {item['answers']}")
+    lines += ["", "💎 <b>Ответы по редкости:</b>"]
+    for rarity in RARITY_NAMES:
+        item = stats["rarities"].get(rarity)
+        if item:
+            lines.append(
+                f"{RARITY_EMOJI[rarity]} {RARITY_NAMES[rarity]}: {item['answers']} (точность {item['accuracy']}%)"
+            )
+
+    hardest = await db.get_hardest_anime(days=7, min_answers=5, limit=3)
+    missed = await db.get_most_missed(mode="quote", days=7, limit=3)   # По аниме: цитаты в свёртках не хранятся
+    if hardest or missed:
+        lines += ["", "🧩 <b>За неделю</b>"]
+    for item in hardest:
+        anime = get_anime_by_id(item["anime_id"])
+        if anime:
+            lines.append(f"😵 {anime['name_ru']}: {item['accuracy']}% из {item['answers']}")
+    for item in missed:
+        anime = get_anime_by_id(item["anime_id"])
+        if anime:
+            lines.append(f"💬 {anime['name_ru']}: {item['wrong']} ошибок по цитатам")
+
+    loop_stats = loop_monitor.stats()
+    last_stall = loop_stats["last_stall"]
+    lines += [
+        "",
+        "🫀 <b>Event loop</b>",
+        f"⏱ Задержка: {loop_stats['lag_last_ms']:.1f} мс (p99 {loop_stats['lag_p99_ms']:.1f}, "
+        f"макс. {loop_stats['lag_max_ms']:.1f})",
+        f"🧊 Зависаний: {loop_stats['stalls']}",
+    ]
+    if last_stall:
+        lines.append(
+            f"📍 Последнее: {last_stall['blocked_ms']} мс — <code>{html.escape(last_stall['where'])}</code>"
+        )
+    await message.answer("\n".join(lines))
+
+
+@dp.message(Command("sample"))
+async def cmd_sample(message: types.Message):
+    """Сэмплирующий профайлер на N секунд (админ): /sample [секунд]"""
+    if message.from_user.id != config.ADMIN_ID:
+        return
+    if active_profiler is not None:
+        await message.answer("🔥 Профилирование уже идёт")
+        return
+
+    parts = message.text.split()
+    seconds = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else config.PROFILE_DEFAULT_SECONDS
+    seconds = max(1, min(seconds, config.PROFILE_MAX_SECONDS))
+
+    await message.answer(f"🔥 Профилирую {seconds} с...")
+    start_background_task(run_profiler(message.chat.id, seconds))
+
+
+async def run_profiler(chat_id: int, seconds: int):
+    """Снять профиль живого трафика и прислать сводку админу"""
+    global active_profiler
+    active_profiler = profiler.SamplingProfiler(interval=config.PROFILE_INTERVAL_MS / 1000)
+    active_profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        result = active_profiler.stop()
+        active_profiler = None
+
+    path = os.path.join(config.PROFILE_DIR, f"profile-{datetime.now():%Y%m%d-%H%M%S}.collapsed")
+    await asyncio.to_thread(result.write_collapsed, path)
+    await bot.send_message(
+        chat_id,
+        f"🔥 <b>Профиль готов</b>\n📄 <code>{html.escape(path)}</code>\n\n"
+        f"<pre>{html.escape(result.summary(limit=12))}</pre>"
     )
 
 
@@ -362,10 +606,7 @@ async def cb_menu(callback: types.CallbackQuery):
     text = config.TEXTS["welcome"]
     if daily_text:
         text = daily_text + "\n" + text
-    try:
-        await callback.message.edit_text(text, reply_markup=get_main_keyboard())
-    except Exception:
-        await callback.message.answer(text, reply_markup=get_main_keyboard())
+    await screens.show(callback.from_user.id, text, get_main_keyboard(), message=callback.message)
 
 
 @dp.callback_query(F.data == "help")
@@ -374,19 +615,15 @@ async def cb_help(callback: types.CallbackQuery):
     back_kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🏠 Меню", callback_data="menu")]
     ])
-    try:
-        await callback.message.edit_text(config.TEXTS["help"], reply_markup=back_kb)
-    except Exception:
-        await callback.message.answer(config.TEXTS["help"], reply_markup=back_kb)
+    await screens.show(callback.from_user.id, config.TEXTS["help"], back_kb, message=callback.message)
 
 
 @dp.callback_query(F.data == "play")
 async def cb_play(callback: types.CallbackQuery):
     await callback.answer()
-    try:
-        await callback.message.edit_text("🎮 <b>Выбери режим игры:</b>", reply_markup=get_play_keyboard())
-    except Exception:
-        await callback.message.answer("🎮 <b>Выбери режим игры:</b>", reply_markup=get_play_keyboard())
+    await screens.show(
+        callback.from_user.id, "🎮 <b>Выбери режим игры:</b>", get_play_keyboard(), message=callback.message
+    )
 
 
 @dp.callback_query(F.data == "prof")
@@ -430,54 +667,56 @@ async def cb_collection_page(callback: types.CallbackQuery):
 async def cb_start_game(callback: types.CallbackQuery):
     """Начать игру в выбранном режиме"""
     await callback.answer()
-    await ensure_player(callback.from_user)
+    user_id = callback.from_user.id
+    mode_map = {"gm_i": "image", "gm_q": "quote", "gm_r": None}
 
-    mode_map = {"gm_i": "image", "gm_q": "quote", "gm_r": random.choice(["image", "quote"])}
-    mode = mode_map[callback.data]
+    # Случайный режим выбираем сразу — иначе заготовка всегда повторяла бы прошлый
+    mode = mode_map[callback.data] or random.choice(["image", "quote"])
 
-    game_id, game_data = create_game(callback.from_user.id, mode)
+    # «Играть ещё» — обычно игра уже заготовлена после ответа
+    prepared = take_prepared_game(user_id, mode)
+    if prepared:
+        game_id, game_data, warm = prepared
+    else:
+        player = await ensure_player(callback.from_user)
+        game_id, game_data = create_game(user_id, mode, selection.skill_band(player))
+        warm = None
     keyboard = get_options_keyboard(game_id, game_data["options"])
 
     if mode == "image":
         # Получаем картинку аниме
         anime = game_data["correct_anime"]
-        image_url = await get_anime_image_url(anime["mal_id"])
+        photo = await resolve_photo(anime["mal_id"], warm)
 
-        if image_url:
+        if photo:
             try:
-                # Удаляем предыдущее сообщение (если возможно)
-                try:
-                    await callback.message.delete()
-                except Exception:
-                    pass
-
-                await bot.send_photo(
-                    chat_id=callback.from_user.id,
-                    photo=image_url,
-                    caption="🖼 <b>Угадай аниме по картинке!</b>\n\n"
-                            f"{RARITY_EMOJI[anime['rarity']]} Редкость: {RARITY_NAMES[anime['rarity']]}\n\n"
-                            "Выбери правильный ответ:",
-                    reply_markup=keyboard
+                sent = await screens.show(
+                    user_id,
+                    "🖼 <b>Угадай аниме по картинке!</b>\n\n"
+                    f"{RARITY_EMOJI[anime['rarity']]} Редкость: {RARITY_NAMES[anime['rarity']]}\n\n"
+                    "Выбери правильный ответ:",
+                    keyboard, photo=photo, message=callback.message,
                 )
+                remember_question(game_data, sent)
+                # Дальше шлём по file_id — Telegram не перекачивает картинку
+                if sent and sent.photo:
+                    photo_file_ids[anime["mal_id"]] = sent.photo[-1].file_id
                 return
             except Exception as e:
                 logger.error(f"Failed to send image: {e}")
+                photo_file_ids.pop(anime["mal_id"], None)
 
         # Фоллбэк — если не удалось загрузить картинку
-        try:
-            await callback.message.edit_text(
-                "🖼 <b>Угадай аниме!</b>\n\n"
-                f"⚠️ Не удалось загрузить картинку.\n"
-                f"🎌 MAL ID: {anime['mal_id']}\n"
-                f"{RARITY_EMOJI[anime['rarity']]} Редкость: {RARITY_NAMES[anime['rarity']]}\n\n"
-                "Выбери правильный ответ:",
-                reply_markup=keyboard
-            )
-        except Exception:
-            await callback.message.answer(
-                "🖼 <b>Угадай аниме!</b>\n\nВыбери правильный ответ:",
-                reply_markup=keyboard
-            )
+        sent = await screens.show(
+            user_id,
+            "🖼 <b>Угадай аниме!</b>\n\n"
+            f"⚠️ Не удалось загрузить картинку.\n"
+            f"🎌 MAL ID: {anime['mal_id']}\n"
+            f"{RARITY_EMOJI[anime['rarity']]} Редкость: {RARITY_NAMES[anime['rarity']]}\n\n"
+            "Выбери правильный ответ:",
+            keyboard, message=callback.message,
+        )
+        remember_question(game_data, sent)
 
     elif mode == "quote":
         quote = game_data["quote"]
@@ -494,19 +733,8 @@ async def cb_start_game(callback: types.CallbackQuery):
             f"Из какого это аниме?"
         )
 
-        try:
-            # Пытаемся удалить предыдущее фото-сообщение если было
-            try:
-                await callback.message.delete()
-            except Exception:
-                pass
-            await bot.send_message(
-                chat_id=callback.from_user.id,
-                text=text,
-                reply_markup=keyboard
-            )
-        except Exception:
-            await callback.message.answer(text, reply_markup=keyboard)
+        sent = await screens.show(user_id, text, keyboard, message=callback.message)
+        remember_question(game_data, sent)
 
 
 # ============ ОБРАБОТКА ОТВЕТА ============
@@ -526,49 +754,53 @@ async def cb_answer(callback: types.CallbackQuery):
         await callback.answer("⚠️ Ошибка", show_alert=True)
         return
 
-    # Получаем игру
-    game = active_games.get(game_id)
-    if not game:
+    # Забираем игру атомарно (до первого await): второе нажатие её уже не получит
+    status, game = active_games.claim(game_id, callback.from_user.id)
+    if status == gamestore.ANSWERED:
+        await callback.answer()   # Двойное нажатие — ответ уже засчитан
+        return
+    if status == gamestore.MISSING:
         await callback.answer("⏰ Игра устарела! Начни новую.", show_alert=True)
         return
-
-    # Проверяем, что отвечает тот же пользователь
-    if game["user_id"] != callback.from_user.id:
+    if status == gamestore.FOREIGN:
         await callback.answer("🚫 Это не твоя игра!", show_alert=True)
         return
 
     await callback.answer()
 
-    # Удаляем игру из активных
-    del active_games[game_id]
-
+    user_id = callback.from_user.id
     correct_anime = game["correct_anime"]
     mode = game["mode"]
     is_correct = chosen_index == game["correct_index"]
     answer_time = time.time() - game["created_at"]
+    if 0 <= chosen_index < len(game["options"]):
+        selection.engine.record_answer(correct_anime["id"], game["options"][chosen_index]["id"])
+
+    # Исход считаем по снимку в памяти, запись в БД — в фоне после ответа
+    snapshot = await player_cache.get(user_id)
+    if snapshot is None:
+        await ensure_player(callback.from_user)
+        snapshot = await player_cache.get(user_id)
+    old_streak = snapshot.player["streak"]
+    now = datetime.now().isoformat()
 
     if is_correct:
         # Правильный ответ
         rarity = correct_anime["rarity"]
         base_xp = RARITY_POINTS[rarity]
-
-        # Получаем текущий стрик ДО обновления
-        old_streak = await db.get_player_streak(callback.from_user.id)
         new_streak = old_streak + 1
 
         # Бонус за серию
         streak_bonus = min(new_streak * config.STREAK_BONUS_XP, config.MAX_STREAK_BONUS)
         total_xp = base_xp + streak_bonus
-
-        # Записываем
-        await db.record_correct_answer(callback.from_user.id, mode, correct_anime["id"], total_xp)
+        snapshot.apply_correct(mode, correct_anime["id"], total_xp, now)
 
         # Проверяем достижения
         extra = {
             "speed_answer": answer_time <= config.SPEED_BONUS_TIME,
             "guessed_legendary": rarity == RARITY_LEGENDARY,
         }
-        new_achs = await check_achievements(callback.from_user.id, extra)
+        rewards = check_achievements(snapshot, extra)
 
         streak_text = f"(🔥 серия ×{new_streak}: +{streak_bonus})" if streak_bonus > 0 else ""
 
@@ -579,105 +811,111 @@ async def cb_answer(callback: types.CallbackQuery):
             xp_earned=total_xp,
             streak_text=streak_text,
             streak=new_streak,
-            new_achievements=format_new_achievements(new_achs),
+            new_achievements=format_new_achievements(list(rewards)),
         )
     else:
         # Неправильный ответ
-        old_streak = await db.get_player_streak(callback.from_user.id)
-        await db.record_wrong_answer(callback.from_user.id, mode, correct_anime["id"])
-
-        new_achs = await check_achievements(callback.from_user.id)
+        total_xp = 0
+        snapshot.apply_wrong(now)
+        rewards = check_achievements(snapshot)
 
         text = config.TEXTS["game_wrong"].format(
             anime_name=f"{correct_anime['name_ru']} ({correct_anime['name']})",
             rarity_emoji=RARITY_EMOJI[correct_anime["rarity"]],
             rarity_name=RARITY_NAMES[correct_anime["rarity"]],
             old_streak=old_streak,
-            new_achievements=format_new_achievements(new_achs),
+            new_achievements=format_new_achievements(list(rewards)),
         )
 
+    persist_answer(user_id, mode, correct_anime["id"], is_correct, total_xp, rewards)
+    prepare_next_game(user_id, mode, selection.skill_band(snapshot.player))
+
     keyboard = get_play_again_keyboard(mode)
 
-    try:
-        # Пытаемся удалить сообщение с вопросом
-        try:
-            await callback.message.delete()
-        except Exception:
-            pass
-        await bot.send_message(
-            chat_id=callback.from_user.id,
-            text=text,
-            reply_markup=keyboard
-        )
-    except Exception:
-        try:
-            await callback.message.edit_text(text, reply_markup=keyboard)
-        except Exception:
-            await callback.message.answer(text, reply_markup=keyboard)
+    # Результат — на месте вопроса (у картинки — подписью под ней)
+    await screens.show(user_id, text, keyboard, message=callback.message, keep_photo=True)
 
 
 # ============ ОТОБРАЖЕНИЕ ПРОФИЛЯ ============
 
-async def show_profile(user_id: int, message: types.Message, edit: bool = False):
-    """Показать профиль игрока"""
-    player = await db.get_player(user_id)
-    if not player:
-        return
-
-    rank = get_rank(player["xp"])
-    total = player["correct_answers"] + player["wrong_answers"]
-    accuracy = round(player["correct_answers"] / total * 100, 1) if total > 0 else 0
-
-    collection_count = await db.get_collection_count(user_id)
-    achievements = await db.get_player_achievements(user_id)
+@lru_cache(maxsize=2048)
+def render_profile(user_id: int, joined_at: str, xp: int, correct: int, wrong: int,
+                   games_played: int, streak: int, max_streak: int, daily_streak: int,
+                   collection_count: int, achievements_count: int) -> str:
+    """Текст профиля (кеш по значениям — любое изменение даёт новый ключ)"""
+    rank = get_rank(xp)
+    total = correct + wrong
+    accuracy = round(correct / total * 100, 1) if total > 0 else 0
 
-    text = config.TEXTS["profile"].format(
+    return config.TEXTS["profile"].format(
         user_id=user_id,
-        joined_date=player["joined_at"][:10] if player["joined_at"] else "—",
+        joined_date=joined_at[:10] if joined_at else "—",
         rank_icon=rank["name"].split()[0],
         rank_name=rank["name"],
-        xp=player["xp"],
-        xp_bar=get_xp_progress(player["xp"]),
-        correct=player["correct_answers"],
-        wrong=player["wrong_answers"],
+        xp=xp,
+        xp_bar=get_xp_progress(xp),
+        correct=correct,
+        wrong=wrong,
         accuracy=accuracy,
-        total_games=player["games_played"],
-        streak=player["streak"],
-        max_streak=player["max_streak"],
-        daily_streak=player["daily_streak"],
+        total_games=games_played,
+        streak=streak,
+        max_streak=max_streak,
+        daily_streak=daily_streak,
         collection=collection_count,
         total_anime=len(ANIME_LIST),
-        achievements_count=len(achievements),
+        achievements_count=achievements_count,
         total_achievements=len(ACHIEVEMENTS),
     )
 
+
+@metrics.observe(metrics.HANDLER_LATENCY, handler="show_profile")
+async def show_profile(user_id: int, message: types.Message, edit: bool = False):
+    """Показать профиль игрока"""
+    snapshot = await player_cache.get(user_id)   # Свои ответы в снимке уже учтены
+    if snapshot is None:
+        return
+    player = snapshot.player
+
+    text = render_profile(
+        user_id,
+        player["joined_at"],
+        player["xp"],
+        player["correct_answers"],
+        player["wrong_answers"],
+        player["games_played"],
+        player["streak"],
+        player["max_streak"],
+        player["daily_streak"],
+        player["collection_count"],
+        player["achievements_count"],
+    )
+
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🎮 Играть", callback_data="play")],
         [InlineKeyboardButton(text="🏠 Меню", callback_data="menu")],
     ])
 
     if edit:
-        try:
-            await message.edit_text(text, reply_markup=keyboard)
-        except Exception:
-            await message.answer(text, reply_markup=keyboard)
+        await screens.show(message.chat.id, text, keyboard, message=message)
     else:
         await message.answer(text, reply_markup=keyboard)
 
 
 # ============ ЛИДЕРБОРД ============
 
+@metrics.observe(metrics.HANDLER_LATENCY, handler="show_leaderboard")
 async def show_leaderboard(user_id: int, message: types.Message, edit: bool = False):
     """Показать топ игроков"""
+    await player_writes.wait(user_id)
     leaders = await db.get_leaderboard(10)
     position = await db.get_player_position(user_id)
 
     medals = ["🥇", "🥈", "🥉"]
     entries = []
-    for i, leader in enumerate(leaders):
+    ranks = ranks_for([leader["xp"] for leader in leaders])
+    for i, (leader, rank) in enumerate(zip(leaders, ranks)):
         medal = medals[i] if i < 3 else f"#{i + 1}"
         name = leader["first_name"] or leader["username"] or f"ID:{leader['user_id']}"
-        rank = get_rank(leader["xp"])
         entries.append(
             f"{medal} <b>{name}</b>\n"
             f"   {rank['name']} • ✨{leader['xp']} XP • ✅{leader['correct_answers']} • 🔥{leader['max_streak']}"
@@ -699,33 +937,18 @@ async def show_leaderboard(user_id: int, message: types.Message, edit: bool = Fa
     ])
 
     if edit:
-        try:
-            await message.edit_text(text, reply_markup=keyboard)
-        except Exception:
-            await message.answer(text, reply_markup=keyboard)
+        await screens.show(message.chat.id, text, keyboard, message=message)
     else:
         await message.answer(text, reply_markup=keyboard)
 
 
 # ============ ДОСТИЖЕНИЯ ============
 
+@metrics.observe(metrics.HANDLER_LATENCY, handler="show_achievements")
 async def show_achievements(user_id: int, message: types.Message, edit: bool = False):
     """Показать достижения"""
-    player_achs = await db.get_player_achievements(user_id)
-    unlocked_ids = {a["id"] for a in player_achs}
-
-    entries = []
-    for ach_id, ach in ACHIEVEMENTS.items():
-        if ach_id in unlocked_ids:
-            entries.append(f"✅ {ach['icon']} <b>{ach['name']}</b> — {ach['description']}")
-        else:
-            entries.append(f"🔒 {ach['icon']} <b>{ach['name']}</b> — {ach['description']}")
-
-    text = config.TEXTS["achievements_header"].format(
-        unlocked=len(unlocked_ids),
-        total=len(ACHIEVEMENTS),
-        entries="\n".join(entries)
-    )
+    snapshot = await player_cache.get(user_id)
+    text = render_achievements(get_achievements_mask(snapshot.achievements if snapshot else ()))
 
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🎮 Играть", callback_data="play")],
@@ -733,50 +956,56 @@ async def show_achievements(user_id: int, message: types.Message, edit: bool = F
     ])
 
     if edit:
-        try:
-            await message.edit_text(text, reply_markup=keyboard)
-        except Exception:
-            await message.answer(text, reply_markup=keyboard)
+        await screens.show(message.chat.id, text, keyboard, message=message)
     else:
         await message.answer(text, reply_markup=keyboard)
 
 
 # ============ КОЛЛЕКЦИЯ ============
 
-async def show_collection(user_id: int, message: types.Message, page: int = 1, edit: bool = False):
-    """Показать коллекцию аниме"""
-    collection = await db.get_collection(user_id)
-    collected_ids = {c["anime_id"] for c in collection}
-
-    # Формируем список всех аниме с пометками
-    all_items = []
-    for anime in ANIME_LIST:
-        if anime["id"] in collected_ids:
-            times = next((c["times_guessed"] for c in collection if c["anime_id"] == anime["id"]), 0)
-            all_items.append(
-                f"✅ {RARITY_EMOJI[anime['rarity']]} <b>{anime['name_ru']}</b> ({anime['name']}) ×{times}"
-            )
-        else:
-            all_items.append(
-                f"❓ {RARITY_EMOJI[anime['rarity']]} ???"
-            )
+COLLECTION_PER_PAGE = 15
+
+
+def format_collection_line(anime: dict, times_guessed: int | None) -> str:
+    """Строка коллекции: угаданное аниме или закрытый слот"""
+    if times_guessed is None:
+        return f"❓ {RARITY_EMOJI[anime['rarity']]} ???"
+    return f"✅ {RARITY_EMOJI[anime['rarity']]} <b>{anime['name_ru']}</b> ({anime['name']}) ×{times_guessed}"
 
-    # Пагинация
-    per_page = 15
-    total_pages = max(1, (len(all_items) + per_page - 1) // per_page)
-    page = max(1, min(page, total_pages))
-    start = (page - 1) * per_page
-    end = start + per_page
-    page_items = all_items[start:end]
 
-    text = config.TEXTS["collection_header"].format(
-        collected=len(collected_ids),
+def get_collection_pages() -> int:
+    """Количество страниц коллекции"""
+    return max(1, (len(ANIME_LIST) + COLLECTION_PER_PAGE - 1) // COLLECTION_PER_PAGE)
+
+
+def render_collection_page(page: int, guessed: dict, collected_count: int) -> str:
+    """Текст страницы коллекции по {anime_id: times_guessed} для этой страницы"""
+    total_pages = get_collection_pages()
+    start = (page - 1) * COLLECTION_PER_PAGE
+    page_anime = ANIME_LIST[start:start + COLLECTION_PER_PAGE]
+    return config.TEXTS["collection_header"].format(
+        collected=collected_count,
         total=len(ANIME_LIST),
-        entries="\n".join(page_items),
+        entries="\n".join(format_collection_line(a, guessed.get(a["id"])) for a in page_anime),
         page=page,
         total_pages=total_pages,
     )
 
+
+@metrics.observe(metrics.HANDLER_LATENCY, handler="show_collection")
+async def show_collection(user_id: int, message: types.Message, page: int = 1, edit: bool = False):
+    """Показать коллекцию аниме"""
+    await player_writes.wait(user_id)
+    # Пагинация по каталогу: из БД берём только аниме текущей страницы
+    total_pages = get_collection_pages()
+    page = max(1, min(page, total_pages))
+    start = (page - 1) * COLLECTION_PER_PAGE
+    page_ids = [a["id"] for a in ANIME_LIST[start:start + COLLECTION_PER_PAGE]]
+
+    guessed = await db.get_collection_page(user_id, page_ids)
+    collected_count = await db.get_collection_count(user_id)
+    text = render_collection_page(page, guessed, collected_count)
+
     # Кнопки навигации
     nav_buttons = []
     if page > 1:
@@ -791,10 +1020,7 @@ async def show_collection(user_id: int, message: types.Message, page: int = 1, e
     ])
 
     if edit:
-        try:
-            await message.edit_text(text, reply_markup=keyboard)
-        except Exception:
-            await message.answer(text, reply_markup=keyboard)
+        await screens.show(message.chat.id, text, keyboard, message=message)
     else:
         await message.answer(text, reply_markup=keyboard)
 
@@ -819,12 +1045,123 @@ async def handle_text(message: types.Message):
     )
 
 
+# ============ ФОНОВЫЕ ЗАДАЧИ ============
+
+def start_background_task(coro) -> asyncio.Task:
+    """Запустить фоновую задачу и держать на неё ссылку"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+async def daily_rollover_loop():
+    """Каждую полночь пакетно сбрасывать прерванные ежедневные серии"""
+    while True:
+        now = datetime.now()
+        midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=1, microsecond=0)
+        await asyncio.sleep((midnight - now).total_seconds())
+        try:
+            reset = await db.rollover_daily_streaks()
+            rollover_cached_streaks()
+            logger.info(f"🌅 Полночь: сброшено ежедневных серий — {reset}")
+            await db.rollup_history()
+            pruned = await db.prune_history()
+            logger.info(f"🧹 Очистка истории: {pruned}")
+        except Exception as e:
+            logger.error(f"Daily rollover error: {e}")
+
+
+async def save_confusion():
+    """Дописать накопленную путаницу в БД (при ошибке приращения вернутся в движок)"""
+    deltas = selection.engine.take_unsaved()
+    try:
+        await db.add_confusion(deltas)
+    except Exception:
+        selection.engine.restore_unsaved(deltas)
+        raise
+
+
+async def selection_rebuild_loop():
+    """Перестраивать таблицы подбора вопросов, когда статистика заметно изменилась,
+    и сохранять путаницу"""
+    while True:
+        await asyncio.sleep(config.SELECTION_CHECK_INTERVAL)
+        try:
+            await save_confusion()
+        except Exception as e:
+            logger.error(f"Confusion save error: {e}")
+        if selection.engine.needs_rebuild():
+            try:
+                await selection.engine.rebuild_async()
+            except Exception as e:
+                logger.error(f"Selection rebuild error: {e}")
+
+
+async def history_rollup_loop():
+    """Периодически сворачивать новые строки game_history в почасовые/дневные корзины"""
+    while True:
+        try:
+            await db.rollup_history()
+        except Exception as e:
+            logger.error(f"History rollup error: {e}")
+        await asyncio.sleep(config.ROLLUP_INTERVAL)
+
+
 # ============ ЗАПУСК ============
 
-async def main():
-    """Запуск бота"""
+async def on_startup():
+    """Подготовка БД и фоновых задач (общая для бота и нагрузочных тестов)"""
     logger.info("🗄 Инициализация базы данных...")
     await db.init_db()
+    await db.start_writer()
+    await db.rollover_daily_streaks()
+    await db.rollup_history()
+    selection.engine.seed(await db.get_anime_accuracy(), await db.get_confusion())
+    await selection.engine.rebuild_async()
+    start_background_task(daily_rollover_loop())
+    start_background_task(history_rollup_loop())
+    start_background_task(selection_rebuild_loop())
+    start_background_task(game_timers.run(on_game_timeouts))
+    start_background_task(loop_monitor.run(debug_slow_callbacks=config.ASYNCIO_DEBUG))
+
+    global metrics_runner, outbound_scheduler
+    outbound_scheduler = outbound.OutboundScheduler(
+        rate=config.TG_RATE, burst=config.TG_BURST,
+        chat_rate=config.TG_CHAT_RATE, chat_burst=config.TG_CHAT_BURST,
+        max_retries=config.TG_MAX_RETRIES,
+    )
+    bot.session.middleware(outbound_scheduler)
+    if config.TRACE_SLOW_MS > 0:
+        bot.session.middleware(tracing.TelegramTracingMiddleware())
+
+    if config.METRICS_PORT:
+        metrics_runner = await metrics.start_server(config.METRICS_HOST, config.METRICS_PORT)
+
+
+async def on_shutdown():
+    """Остановка фоновых задач и писателя БД"""
+    global metrics_runner, outbound_scheduler
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await player_writes.drain()
+    try:
+        await save_confusion()
+    except Exception as e:
+        logger.error(f"Confusion save error: {e}")
+    await db.stop_writer()
+    if outbound_scheduler is not None:
+        await outbound_scheduler.close()
+        outbound_scheduler = None
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+        metrics_runner = None
+
+
+async def main():
+    """Запуск бота"""
+    await on_startup()
 
     logger.info("🎌 Запуск бота 'Угадай Аниме'...")
 
@@ -832,7 +1169,10 @@ async def main():
     await bot.delete_webhook(drop_pending_updates=True)
 
     # Запуск
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await on_shutdown()
 
 
 if __name__ == "__main__":
@@ -17,14 +17,63 @@ except ValueError:
 
 # ============ БАЗА ДАННЫХ ============
 DATABASE_PATH = "anime_game.db"
+DB_SHARDS = int(os.getenv("DB_SHARDS", "1"))  # Файлов-шардов по user_id (>1 — anime_game.<N>.db)
+DB_WRITE_BATCH = 256               # Максимум операций в одной транзакции писателя
+
+# ============ АНАЛИТИКА (свёртки game_history) ============
+ROLLUP_INTERVAL = 300             # Секунд между инкрементальными свёртками
+ROLLUP_BATCH = 5000               # Строк истории за одну транзакцию
+HISTORY_RAW_DAYS = 30             # Сколько дней хранить сырые строки game_history
+HISTORY_HOURLY_DAYS = 90          # Сколько дней хранить почасовые корзины (дневные — всегда)
+HISTORY_ARCHIVE_DIR = "history_archive"  # Куда уезжают старые строки ("" — просто удалять)
+
+# ============ ИСХОДЯЩИЕ ВЫЗОВЫ TELEGRAM ============
+TG_RATE = float(os.getenv("TG_RATE", "30"))  # Вызовов Bot API в секунду на бота (0 — без лимита)
+TG_BURST = 30                     # Сколько подряд без ожидания (общий лимит)
+TG_CHAT_RATE = 1.0                # Вызовов в секунду на чат (0 — без лимита)
+TG_CHAT_BURST = 3                 # Сколько подряд в один чат без ожидания
+TG_MAX_RETRIES = 3                # Повторов после TelegramRetryAfter
+
+# ============ КОНТРОЛЬ НАГРУЗКИ ============
+ADMISSION_LIMIT = int(os.getenv("ADMISSION_LIMIT", "200"))  # Обработчиков апдейтов одновременно (0 — без лимита)
+ADMISSION_QUEUES = (1000, 300, 100)   # Мест в очередях на допуск: ответы, новые вопросы, экраны
+ADMISSION_MAX_WAIT = 5.0              # Дольше в очереди — отвечаем «занято»
+
+# ============ МЕТРИКИ ============
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))   # 0 — HTTP /metrics выключен
+
+# ============ ТРАССИРОВКА ============
+TRACE_SLOW_MS = int(os.getenv("TRACE_SLOW_MS", "0"))  # Логировать апдейты дольше N мс (0 — выкл.)
+
+# ============ МОНИТОРИНГ EVENT LOOP ============
+LOOP_MONITOR_INTERVAL_MS = 250    # Период тикера задержки
+LOOP_STALL_MS = int(os.getenv("LOOP_STALL_MS", "100"))  # Порог зависания (снимаем стек)
+ASYNCIO_DEBUG = os.getenv("ASYNCIO_DEBUG", "") == "1"   # Отчёты asyncio о медленных колбэках
+
+# ============ ПРОФИЛИРОВАНИЕ (/sample) ============
+PROFILE_DIR = "profiles"          # Куда писать collapsed stacks
+PROFILE_INTERVAL_MS = 5           # Интервал сэмплирования
+PROFILE_DEFAULT_SECONDS = 30      # Длительность по умолчанию
+PROFILE_MAX_SECONDS = 300         # Максимальная длительность
 
 # ============ ИГРОВЫЕ НАСТРОЙКИ ============
 GAME_TIMEOUT = 60          # Секунд на ответ
+GAME_TIMER_TICK = 0.25     # Точность таймаутов игр (тик колеса таймеров), секунд
 OPTIONS_COUNT = 4          # Количество вариантов ответа
 STREAK_BONUS_XP = 5        # Бонус XP за каждый уровень стрика
 MAX_STREAK_BONUS = 50      # Максимальный бонус стрика
 SPEED_BONUS_TIME = 3       # Секунд для достижения "Скоростной"
+PREPARED_GAME_TTL = 90     # Секунд живёт заготовленная следующая игра
+PREPARED_GAMES_MAX = 10000 # Максимум заготовок в памяти (по одной на игрока)
 DAILY_BONUS_XP = 25        # XP за ежедневный вход
+DAILY_STREAK_BONUSES = [   # (дней подряд, доп. XP) — от большего порога к меньшему
+    (7, 50),
+    (3, 15),
+]
+
+# ============ ПОДБОР ВОПРОСОВ ============
+SELECTION_CHECK_INTERVAL = 30     # Секунд между проверками, не пора ли перестроить таблицы
 
 # ============ JIKAN API (бесплатный MyAnimeList API) ============
 JIKAN_BASE_URL = "https://api.jikan.moe/v4"
@@ -114,6 +163,8 @@ TEXTS = {
 {new_achievements}
 """,
 
+    "busy": "⏳ Слишком много игроков, попробуй через пару секунд",
+
     "game_timeout": """
 ⏰ <b>Время вышло!</b>
 
@@ -0,0 +1,67 @@
+"""
+🧮 Счётчики активности в памяти для /stats
+Активные игроки за 1ч/24ч/7д и ответы в минуту — всё за O(1) (амортизированно)
+"""
+import time
+from collections import OrderedDict, deque
+
+ACTIVITY_WINDOWS = {
+    "1h": 3600,
+    "24h": 24 * 3600,
+    "7d": 7 * 24 * 3600,
+}
+
+
+class ActivityTracker:
+    """Скользящие окна активных игроков и поминутные счётчики ответов"""
+
+    def __init__(self, windows: dict = ACTIVITY_WINDOWS, minutes: int = 60):
+        self.windows = dict(windows)
+        # Для каждого окна: user_id -> время последней активности, по возрастанию времени
+        self._seen: dict[str, OrderedDict] = {name: OrderedDict() for name in self.windows}
+        self._minutes: deque = deque(maxlen=minutes)   # [минута, ответов]
+
+    def touch(self, user_id: int, ts: float | None = None):
+        """Отметить активность игрока"""
+        ts = time.time() if ts is None else ts
+        for seen in self._seen.values():
+            seen.pop(user_id, None)
+            seen[user_id] = ts
+
+    def record_answer(self, user_id: int, ts: float | None = None):
+        """Ответ игрока: активность + поминутный счётчик"""
+        ts = time.time() if ts is None else ts
+        self.touch(user_id, ts)
+        minute = int(ts // 60)
+        if self._minutes and self._minutes[-1][0] == minute:
+            self._minutes[-1][1] += 1
+        else:
+            self._minutes.append([minute, 1])
+
+    def active(self, window: str, now: float | None = None) -> int:
+        """Сколько игроков были активны за окно"""
+        now = time.time() if now is None else now
+        seen = self._seen[window]
+        cutoff = now - self.windows[window]
+        while seen:
+            user_id, ts = next(iter(seen.items()))
+            if ts >= cutoff:
+                break
+            seen.popitem(last=False)
+        return len(seen)
+
+    def answers_per_minute(self, now: float | None = None) -> dict:
+        """Ответов за последнюю полную минуту и в среднем за час"""
+        now = time.time() if now is None else now
+        current = int(now // 60)
+        last_minute = 0
+        last_hour = 0
+        for minute, count in self._minutes:
+            if minute == current - 1:
+                last_minute = count
+            if current - 60 <= minute < current:
+                last_hour += count
+        return {"last_minute": last_minute, "avg_1h": last_hour / 60}
+
+
+activity = ActivityTracker()
@@ -1,15 +1,132 @@
 """
 🗄 База данных для игры "Угадай Аниме"
-Таблицы: игроки, достижения, коллекция, история игр
+Таблицы: игроки, достижения, коллекция, история игр, счётчики бота,
+свёртки истории по часам/дням.
+Данные игроков разложены по DB_SHARDS файлам по user_id; в каждом шарде
+свои счётчики и свёртки, глобальные запросы объединяют шарды.
 """
+import asyncio
+import functools
+import heapq
+import os
 import aiosqlite
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from config import DATABASE_PATH
+import archive
+from anime_data import ANIME_BY_ID
+from config import (
+    DATABASE_PATH, DB_SHARDS, DB_WRITE_BATCH, DAILY_BONUS_XP, DAILY_STREAK_BONUSES,
+    ROLLUP_BATCH, HISTORY_RAW_DAYS, HISTORY_HOURLY_DAYS, HISTORY_ARCHIVE_DIR,
+)
+from counters import activity
+from dbwriter import GroupCommitWriter
+from metrics import DB_COMMITS, track_db
+
+
+def shard_of(user_id: int) -> int:
+    """Номер шарда, где лежат данные игрока"""
+    return user_id % DB_SHARDS
+
+
+def shard_path(shard: int) -> str:
+    """Файл шарда: при одном шарде — сам DATABASE_PATH, иначе anime_game.<N>.db"""
+    if DB_SHARDS == 1:
+        return DATABASE_PATH
+    base, ext = os.path.splitext(DATABASE_PATH)
+    return f"{base}.{shard}{ext}"
+
+
+def _connect(shard: int = 0):
+    """Соединение с шардом (пути вида file:...?mode=memory открываются как URI)"""
+    path = shard_path(shard)
+    return aiosqlite.connect(path, uri=path.startswith("file:"))
+
+
+async def _commit(db):
+    """COMMIT с учётом в метриках"""
+    await db.commit()
+    DB_COMMITS.inc()
+
+
+@asynccontextmanager
+async def _read(shard: int = 0):
+    """Отдельное соединение только для чтения (пишет один писатель на шард)"""
+    async with _connect(shard) as db:
+        await db.execute("PRAGMA query_only = ON")
+        yield db
+
+
+async def _read_all(sql: str, params: tuple = ()) -> list:
+    """Выполнить запрос на всех шардах параллельно: [строки шарда 0, строки шарда 1, ...]"""
+    async def fetch(shard: int) -> list:
+        async with _read(shard) as db:
+            cursor = await db.execute(sql, params)
+            return await cursor.fetchall()
+    return await asyncio.gather(*(fetch(shard) for shard in range(DB_SHARDS)))
+
+
+def _merge_sums(shard_rows: list) -> dict:
+    """Строки шардов (ключ, число, ...) -> {ключ: [сумма, ...]}"""
+    merged: dict = {}
+    for rows in shard_rows:
+        for key, *values in rows:
+            sums = merged.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                sums[i] += value or 0
+    return merged
+
+
+# Все изменения шарда идут через его писателя с групповым коммитом
+_writers: dict[int, GroupCommitWriter] = {}
+
+
+def _get_writer(shard: int) -> GroupCommitWriter:
+    writer = _writers.get(shard)
+    if writer is None:
+        writer = _writers[shard] = GroupCommitWriter(
+            functools.partial(_connect, shard), name=f"shard{shard}", max_batch=DB_WRITE_BATCH
+        )
+    return writer
+
+
+async def start_writer():
+    """Запустить писателей всех шардов (после init_db)"""
+    for shard in range(DB_SHARDS):
+        await _get_writer(shard).start()
+
+
+async def stop_writer():
+    """Дописать очереди и остановить писателей"""
+    for writer in list(_writers.values()):
+        await writer.stop()
+
+
+async def _write(op, shard: int = 0):
+    """Выполнить op(db) в транзакции писателя шарда и дождаться COMMIT"""
+    return await _get_writer(shard).submit(op)
+
+
+async def _write_all(op) -> list:
+    """Выполнить op(db) на всех шардах: [результат шарда 0, ...]"""
+    return await asyncio.gather(*(_write(op, shard) for shard in range(DB_SHARDS)))
 
 
 async def init_db():
-    """Инициализация базы данных"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    """Инициализация базы данных (всех шардов)"""
+    seen = []
+    for shard in range(DB_SHARDS):
+        seen += await _init_shard(shard)
+    # Окна активности заполняются по возрастанию времени
+    for ts, user_id in sorted(seen):
+        activity.touch(user_id, ts)
+
+
+async def _init_shard(shard: int) -> list:
+    """Схема и миграции одного шарда. Возвращает недавнюю активность [(ts, user_id)]"""
+    async with _connect(shard) as db:
+        # WAL: читатели не ждут писателя (режим сохраняется в файле БД)
+        await db.execute("PRAGMA journal_mode = WAL")
+
         # Таблица игроков
         await db.execute("""
             CREATE TABLE IF NOT EXISTS players (
@@ -27,9 +144,12 @@ async def init_db():
                 daily_streak INTEGER DEFAULT 0,
                 last_daily TEXT DEFAULT '',
                 last_played TEXT DEFAULT '',
-                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                collection_count INTEGER DEFAULT 0,
+                achievements_count INTEGER DEFAULT 0
             )
         """)
+        await _migrate_player_counters(db)
 
         # Таблица достижений
         await db.execute("""
@@ -41,6 +161,11 @@ async def init_db():
             )
         """)
 
+        # Индекс для ночного сброса ежедневных серий
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_players_last_daily ON players (last_daily)"
+        )
+
         # Таблица коллекции (какие аниме угадал)
         await db.execute("""
             CREATE TABLE IF NOT EXISTS collection (
@@ -65,14 +190,142 @@ async def init_db():
             )
         """)
 
-        await db.commit()
+        # Агрегированные счётчики бота (обновляются вместе с ответами)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS bot_counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        await _backfill_bot_counters(db)
+
+        # Свёртки game_history: корзины по часам и по дням
+        for table in ("history_hourly", "history_daily"):
+            await db.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    bucket TEXT,
+                    mode TEXT,
+                    anime_id INTEGER,
+                    was_correct INTEGER,
+                    answers INTEGER NOT NULL DEFAULT 0,
+                    xp_earned INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (bucket, mode, anime_id, was_correct)
+                ) WITHOUT ROWID
+            """)
+
+        # Путаница: какой неверный вариант выбирали вместо правильного (для подбора дистракторов)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS anime_confusion (
+                anime_id INTEGER,
+                chosen_id INTEGER,
+                picks INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (anime_id, chosen_id)
+            ) WITHOUT ROWID
+        """)
+
+        # Докуда история уже свёрнута (high-water mark по game_history.id)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS rollup_state (
+                name TEXT PRIMARY KEY,
+                last_id INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+
+        await _commit(db)
+        return await _recent_activity(db)
+
+
+async def _migrate_player_counters(db):
+    """Добавить счётчики коллекции/достижений в старую таблицу players"""
+    cursor = await db.execute("PRAGMA table_info(players)")
+    columns = {row[1] for row in await cursor.fetchall()}
+    if "collection_count" in columns and "achievements_count" in columns:
+        return
+
+    for column in ("collection_count", "achievements_count"):
+        if column not in columns:
+            await db.execute(f"ALTER TABLE players ADD COLUMN {column} INTEGER DEFAULT 0")
+
+    # Заполняем по существующим данным (один раз)
+    await db.execute("""
+        UPDATE players SET
+            collection_count = (SELECT COUNT(*) FROM collection c WHERE c.user_id = players.user_id),
+            achievements_count = (SELECT COUNT(*) FROM achievements a WHERE a.user_id = players.user_id)
+    """)
+
+
+async def _backfill_bot_counters(db):
+    """Заполнить bot_counters по существующим данным (один раз, при пустой таблице)"""
+    cursor = await db.execute("SELECT 1 FROM bot_counters LIMIT 1")
+    if await cursor.fetchone():
+        return
+
+    totals: dict[str, int] = {}
+    cursor = await db.execute(
+        "SELECT COUNT(*), COALESCE(SUM(games_played), 0), COALESCE(SUM(correct_answers), 0) FROM players"
+    )
+    totals["players"], totals["games"], totals["correct"] = await cursor.fetchone()
+
+    cursor = await db.execute("""
+        SELECT mode, anime_id, COUNT(*), SUM(was_correct)
+        FROM game_history GROUP BY mode, anime_id
+    """)
+    for mode, anime_id, answers, correct in await cursor.fetchall():
+        names = [f"mode:{mode}"]
+        anime = ANIME_BY_ID.get(anime_id)
+        if anime:
+            names.append(f"rarity:{anime['rarity']}")
+        for name in names:
+            totals[f"{name}:answers"] = totals.get(f"{name}:answers", 0) + answers
+            totals[f"{name}:correct"] = totals.get(f"{name}:correct", 0) + (correct or 0)
+
+    await db.executemany(
+        "INSERT INTO bot_counters (name, value) VALUES (?, ?)", list(totals.items())
+    )
+
+
+async def _bump_counters(db, names: list):
+    """Увеличить счётчики бота на 1 (в текущей транзакции)"""
+    await db.executemany("""
+        INSERT INTO bot_counters (name, value) VALUES (?, 1)
+        ON CONFLICT(name) DO UPDATE SET value = value + 1
+    """, [(name,) for name in names])
+
+
+def _answer_counters(mode: str, anime_id: int, correct: bool) -> list:
+    """Какие счётчики затрагивает ответ"""
+    names = ["games", f"mode:{mode}:answers"]
+    if correct:
+        names += ["correct", f"mode:{mode}:correct"]
+    anime = ANIME_BY_ID.get(anime_id)
+    if anime:
+        names.append(f"rarity:{anime['rarity']}:answers")
+        if correct:
+            names.append(f"rarity:{anime['rarity']}:correct")
+    return names
+
+
+async def _recent_activity(db) -> list:
+    """Активность за неделю по last_played (для окон активности после рестарта)"""
+    since = (datetime.now() - timedelta(days=7)).isoformat()
+    cursor = await db.execute(
+        "SELECT user_id, last_played FROM players WHERE last_played >= ?", (since,)
+    )
+    seen = []
+    for user_id, last_played in await cursor.fetchall():
+        try:
+            seen.append((datetime.fromisoformat(last_played).timestamp(), user_id))
+        except ValueError:
+            continue
+    return seen
 
 
 # ============ ИГРОКИ ============
 
+@track_db
 async def get_player(user_id: int) -> dict | None:
     """Получить данные игрока"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with _read(shard_of(user_id)) as db:
         db.row_factory = aiosqlite.Row
         cursor = await db.execute(
             "SELECT * FROM players WHERE user_id = ?", (user_id,)
@@ -81,39 +334,74 @@ async def get_player(user_id: int) -> dict | None:
         return dict(row) if row else None
 
 
+@track_db
+async def get_player_snapshot(user_id: int) -> tuple | None:
+    """Игрок, его достижения и коллекция одним чтением: (player, {achievement_id}, {anime_id})"""
+    async with _read(shard_of(user_id)) as db:
+        db.row_factory = aiosqlite.Row
+        cursor = await db.execute("SELECT * FROM players WHERE user_id = ?", (user_id,))
+        row = await cursor.fetchone()
+        if not row:
+            return None
+        cursor = await db.execute("SELECT achievement_id FROM achievements WHERE user_id = ?", (user_id,))
+        achievements = {r[0] for r in await cursor.fetchall()}
+        cursor = await db.execute("SELECT anime_id FROM collection WHERE user_id = ?", (user_id,))
+        collection = {r[0] for r in await cursor.fetchall()}
+    return dict(row), achievements, collection
+
+
+@track_db
 async def create_player(user_id: int, username: str, first_name: str):
     """Создать нового игрока"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("""
+    async def op(db):
+        cursor = await db.execute("""
             INSERT OR IGNORE INTO players (user_id, username, first_name)
             VALUES (?, ?, ?)
         """, (user_id, username, first_name))
-        await db.commit()
+        if cursor.rowcount > 0:
+            await _bump_counters(db, ["players"])
+    await _write(op, shard_of(user_id))
 
 
+@track_db
 async def update_player_info(user_id: int, username: str, first_name: str):
     """Обновить информацию об игроке"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async def op(db):
         await db.execute("""
             UPDATE players SET username = ?, first_name = ? WHERE user_id = ?
         """, (username, first_name, user_id))
-        await db.commit()
+    await _write(op, shard_of(user_id))
 
 
+@track_db
 async def add_xp(user_id: int, xp: int):
     """Добавить XP игроку"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async def op(db):
         await db.execute(
             "UPDATE players SET xp = xp + ? WHERE user_id = ?",
             (xp, user_id)
         )
-        await db.commit()
+    await _write(op, shard_of(user_id))
 
 
+@track_db
 async def record_correct_answer(user_id: int, mode: str, anime_id: int, xp_earned: int):
     """Записать правильный ответ"""
     now = datetime.now().isoformat()
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+
+    async def op(db):
+        # Добавляем в коллекцию (новое аниме увеличивает счётчик коллекции)
+        cursor = await db.execute(
+            "INSERT OR IGNORE INTO collection (user_id, anime_id) VALUES (?, ?)",
+            (user_id, anime_id)
+        )
+        is_new = cursor.rowcount > 0
+        if not is_new:
+            await db.execute(
+                "UPDATE collection SET times_guessed = times_guessed + 1 WHERE user_id = ? AND anime_id = ?",
+                (user_id, anime_id)
+            )
+
         # Обновляем статистику игрока
         mode_field = "correct_by_image" if mode == "image" else "correct_by_quote"
         await db.execute(f"""
@@ -124,9 +412,10 @@ async def record_correct_answer(user_id: int, mode: str, anime_id: int, xp_earne
                 games_played = games_played + 1,
                 {mode_field} = {mode_field} + 1,
                 xp = xp + ?,
-                last_played = ?
+                last_played = ?,
+                collection_count = collection_count + ?
             WHERE user_id = ?
-        """, (xp_earned, now, user_id))
+        """, (xp_earned, now, int(is_new), user_id))
 
         # Записываем в историю
         await db.execute("""
@@ -134,20 +423,18 @@ async def record_correct_answer(user_id: int, mode: str, anime_id: int, xp_earne
             VALUES (?, ?, ?, 1, ?)
         """, (user_id, mode, anime_id, xp_earned))
 
-        # Добавляем в коллекцию
-        await db.execute("""
-            INSERT INTO collection (user_id, anime_id)
-            VALUES (?, ?)
-            ON CONFLICT(user_id, anime_id) DO UPDATE SET times_guessed = times_guessed + 1
-        """, (user_id, anime_id))
+        await _bump_counters(db, _answer_counters(mode, anime_id, correct=True))
 
-        await db.commit()
+    await _write(op, shard_of(user_id))
+    activity.record_answer(user_id)
 
 
+@track_db
 async def record_wrong_answer(user_id: int, mode: str, anime_id: int):
     """Записать неправильный ответ"""
     now = datetime.now().isoformat()
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+
+    async def op(db):
         await db.execute("""
             UPDATE players SET
                 wrong_answers = wrong_answers + 1,
@@ -162,12 +449,16 @@ async def record_wrong_answer(user_id: int, mode: str, anime_id: int):
             VALUES (?, ?, ?, 0, 0)
         """, (user_id, mode, anime_id))
 
-        await db.commit()
+        await _bump_counters(db, _answer_counters(mode, anime_id, correct=False))
 
+    await _write(op, shard_of(user_id))
+    activity.record_answer(user_id)
 
+
+@track_db
 async def get_player_streak(user_id: int) -> int:
     """Получить текущую серию игрока"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with _read(shard_of(user_id)) as db:
         cursor = await db.execute(
             "SELECT streak FROM players WHERE user_id = ?", (user_id,)
         )
@@ -175,44 +466,96 @@ async def get_player_streak(user_id: int) -> int:
         return row[0] if row else 0
 
 
+@track_db
+async def reset_streaks(user_ids: list) -> int:
+    """Сбросить серии игрокам (пачкой, по одной операции на шард). Возвращает число строк."""
+    by_shard: dict[int, list] = {}
+    for user_id in set(user_ids):
+        by_shard.setdefault(shard_of(user_id), []).append(user_id)
+
+    def make_op(ids: list):
+        async def op(db):
+            reset = 0
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                cursor = await db.execute(
+                    f"UPDATE players SET streak = 0 WHERE streak > 0 AND user_id IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                )
+                reset += cursor.rowcount
+            return reset
+        return op
+
+    results = await asyncio.gather(*(_write(make_op(ids), shard) for shard, ids in by_shard.items()))
+    return sum(results)
+
+
 # ============ ЕЖЕДНЕВНЫЙ БОНУС ============
 
+def _daily_bonus_sql(streak_expr: str) -> str:
+    """SQL-выражение бонусного XP за вход при серии streak_expr"""
+    cases = " ".join(
+        f"WHEN {streak_expr} >= {days} THEN {xp}" for days, xp in DAILY_STREAK_BONUSES
+    )
+    return f"({DAILY_BONUS_XP} + CASE {cases} ELSE 0 END)" if cases else str(DAILY_BONUS_XP)
+
+
+# Новая серия считается по старым значениям колонок (так работает UPDATE в SQLite),
+# а RETURNING видит уже обновлённую daily_streak
+_NEW_DAILY_STREAK = "(CASE WHEN last_daily = :yesterday THEN daily_streak + 1 ELSE 1 END)"
+_DAILY_UPDATE_SQL = f"""
+    UPDATE players SET
+        daily_streak = {_NEW_DAILY_STREAK},
+        xp = xp + {_daily_bonus_sql(_NEW_DAILY_STREAK)},
+        last_daily = :today
+    WHERE user_id = :user_id AND last_daily != :today
+    RETURNING daily_streak, {_daily_bonus_sql("daily_streak")}
+"""
+
+
+@track_db
 async def check_and_update_daily(user_id: int) -> dict | None:
-    """Проверить и начислить ежедневный бонус. Возвращает None если уже получен сегодня."""
-    today = datetime.now().strftime("%Y-%m-%d")
-    player = await get_player(user_id)
-    if not player:
-        return None
+    """Атомарно засчитать ежедневный вход и начислить бонус XP.
+    Возвращает None если бонус уже получен сегодня."""
+    now = datetime.now()
+    params = {
+        "user_id": user_id,
+        "today": now.strftime("%Y-%m-%d"),
+        "yesterday": (now - timedelta(days=1)).strftime("%Y-%m-%d"),
+    }
+
+    async def op(db):
+        cursor = await db.execute(_DAILY_UPDATE_SQL, params)
+        row = await cursor.fetchone()
+        await cursor.close()
+        return row
 
-    last_daily = player.get("last_daily", "")
+    row = await _write(op, shard_of(user_id))
+    if not row:
+        return None  # Уже получен (или игрока нет)
+    return {"daily_streak": row[0], "bonus_xp": row[1], "last_daily": params["today"]}
 
-    if last_daily == today:
-        return None  # Уже получен
 
-    # Проверяем стрик ежедневного входа
+@track_db
+async def rollover_daily_streaks() -> int:
+    """Сбросить серии тем, кто пропустил вчерашний день. Возвращает число игроков."""
     yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
-    if last_daily == yesterday:
-        new_daily_streak = player["daily_streak"] + 1
-    else:
-        new_daily_streak = 1
 
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("""
-            UPDATE players SET
-                last_daily = ?,
-                daily_streak = ?
-            WHERE user_id = ?
-        """, (today, new_daily_streak, user_id))
-        await db.commit()
-
-    return {"daily_streak": new_daily_streak}
+    async def op(db):
+        cursor = await db.execute(
+            "UPDATE players SET daily_streak = 0 WHERE last_daily < ? AND daily_streak > 0",
+            (yesterday,)
+        )
+        return cursor.rowcount
+    return sum(await _write_all(op))
 
 
 # ============ ДОСТИЖЕНИЯ ============
 
+@track_db
 async def get_player_achievements(user_id: int) -> list:
     """Получить список достижений игрока"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with _read(shard_of(user_id)) as db:
         cursor = await db.execute(
             "SELECT achievement_id, unlocked_at FROM achievements WHERE user_id = ?",
             (user_id,)
@@ -221,9 +564,10 @@ async def get_player_achievements(user_id: int) -> list:
         return [{"id": row[0], "unlocked_at": row[1]} for row in rows]
 
 
+@track_db
 async def has_achievement(user_id: int, achievement_id: str) -> bool:
     """Проверить, есть ли достижение у игрока"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with _read(shard_of(user_id)) as db:
         cursor = await db.execute(
             "SELECT 1 FROM achievements WHERE user_id = ? AND achievement_id = ?",
             (user_id, achievement_id)
@@ -231,24 +575,51 @@ async def has_achievement(user_id: int, achievement_id: str) -> bool:
         return await cursor.fetchone() is not None
 
 
+@track_db
 async def unlock_achievement(user_id: int, achievement_id: str) -> bool:
     """Разблокировать достижение. Возвращает True если новое."""
-    if await has_achievement(user_id, achievement_id):
-        return False
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute(
+    async def op(db):
+        cursor = await db.execute(
             "INSERT OR IGNORE INTO achievements (user_id, achievement_id) VALUES (?, ?)",
             (user_id, achievement_id)
         )
-        await db.commit()
-    return True
+        if cursor.rowcount == 0:
+            return False
+        await db.execute(
+            "UPDATE players SET achievements_count = achievements_count + 1 WHERE user_id = ?",
+            (user_id,)
+        )
+        return True
+    return await _write(op, shard_of(user_id))
+
+
+@track_db
+async def unlock_achievements(user_id: int, rewards: dict) -> list:
+    """Разблокировать достижения {achievement_id: reward_xp} и начислить награды
+    одной операцией. Возвращает новые (уже открытые пропускаются)."""
+    async def op(db):
+        unlocked = []
+        for achievement_id, reward_xp in rewards.items():
+            cursor = await db.execute(
+                "INSERT OR IGNORE INTO achievements (user_id, achievement_id) VALUES (?, ?)",
+                (user_id, achievement_id)
+            )
+            if cursor.rowcount > 0:
+                unlocked.append(achievement_id)
+                await db.execute("""
+                    UPDATE players SET achievements_count = achievements_count + 1, xp = xp + ?
+                    WHERE user_id = ?
+                """, (reward_xp, user_id))
+        return unlocked
+    return await _write(op, shard_of(user_id))
 
 
 # ============ КОЛЛЕКЦИЯ ============
 
+@track_db
 async def get_collection(user_id: int) -> list:
     """Получить коллекцию игрока"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with _read(shard_of(user_id)) as db:
         cursor = await db.execute(
             "SELECT anime_id, first_guessed_at, times_guessed FROM collection WHERE user_id = ? ORDER BY first_guessed_at",
             (user_id,)
@@ -257,90 +628,323 @@ async def get_collection(user_id: int) -> list:
         return [{"anime_id": r[0], "first_guessed_at": r[1], "times_guessed": r[2]} for r in rows]
 
 
+@track_db
+async def get_collection_page(user_id: int, anime_ids: list) -> dict:
+    """Получить {anime_id: times_guessed} только для указанных аниме"""
+    if not anime_ids:
+        return {}
+    placeholders = ", ".join("?" * len(anime_ids))
+    async with _read(shard_of(user_id)) as db:
+        cursor = await db.execute(
+            f"SELECT anime_id, times_guessed FROM collection WHERE user_id = ? AND anime_id IN ({placeholders})",
+            (user_id, *anime_ids)
+        )
+        rows = await cursor.fetchall()
+        return {r[0]: r[1] for r in rows}
+
+
+@track_db
 async def get_collection_count(user_id: int) -> int:
     """Получить количество аниме в коллекции"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with _read(shard_of(user_id)) as db:
         cursor = await db.execute(
-            "SELECT COUNT(*) FROM collection WHERE user_id = ?",
+            "SELECT collection_count FROM players WHERE user_id = ?",
             (user_id,)
         )
         row = await cursor.fetchone()
         return row[0] if row else 0
 
 
+@track_db
 async def get_collection_rarities(user_id: int) -> set:
     """Получить множество редкостей собранных аниме"""
-    from anime_data import ANIME_LIST
     collection = await get_collection(user_id)
-    collected_ids = {c["anime_id"] for c in collection}
-    rarities = set()
-    for anime in ANIME_LIST:
-        if anime["id"] in collected_ids:
-            rarities.add(anime["rarity"])
-    return rarities
+    return {
+        ANIME_BY_ID[c["anime_id"]]["rarity"]
+        for c in collection if c["anime_id"] in ANIME_BY_ID
+    }
 
 
 # ============ ЛИДЕРБОРД ============
 
+@track_db
 async def get_leaderboard(limit: int = 10) -> list:
-    """Получить топ игроков по XP"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cursor = await db.execute("""
-            SELECT user_id, username, first_name, xp, correct_answers, streak, max_streak
-            FROM players
-            ORDER BY xp DESC
-            LIMIT ?
-        """, (limit,))
-        rows = await cursor.fetchall()
-        return [
-            {
-                "user_id": r[0],
-                "username": r[1],
-                "first_name": r[2],
-                "xp": r[3],
-                "correct_answers": r[4],
-                "streak": r[5],
-                "max_streak": r[6],
-            }
-            for r in rows
-        ]
+    """Получить топ игроков по XP (топ каждого шарда, слитый в общий)"""
+    shard_rows = await _read_all("""
+        SELECT user_id, username, first_name, xp, correct_answers, streak, max_streak
+        FROM players
+        ORDER BY xp DESC
+        LIMIT ?
+    """, (limit,))
+    rows = heapq.nlargest(limit, (r for rows in shard_rows for r in rows), key=lambda r: r[3])
+    return [
+        {
+            "user_id": r[0],
+            "username": r[1],
+            "first_name": r[2],
+            "xp": r[3],
+            "correct_answers": r[4],
+            "streak": r[5],
+            "max_streak": r[6],
+        }
+        for r in rows
+    ]
 
 
+@track_db
 async def get_player_position(user_id: int) -> int:
     """Получить позицию игрока в рейтинге"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cursor = await db.execute("""
-            SELECT COUNT(*) + 1 FROM players
-            WHERE xp > (SELECT COALESCE(xp, 0) FROM players WHERE user_id = ?)
-        """, (user_id,))
+    async with _read(shard_of(user_id)) as db:
+        cursor = await db.execute("SELECT xp FROM players WHERE user_id = ?", (user_id,))
         row = await cursor.fetchone()
-        return row[0] if row else 0
+    if not row:
+        return 1
+    shard_rows = await _read_all("SELECT COUNT(*) FROM players WHERE xp > ?", (row[0] or 0,))
+    return 1 + sum(rows[0][0] for rows in shard_rows)
 
 
-# ============ СТАТИСТИКА (АДМИН) ============
+# ============ СВЁРТКИ ИСТОРИИ ============
+
+# Длина префикса played_at ("YYYY-MM-DD HH:MM:SS", UTC), задающая корзину
+_ROLLUP_BUCKETS = {"history_hourly": 13, "history_daily": 10}
 
-async def get_bot_stats() -> dict:
-    """Получить статистику бота"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cursor = await db.execute("SELECT COUNT(*) FROM players")
-        total_players = (await cursor.fetchone())[0]
 
-        today = datetime.now().strftime("%Y-%m-%d")
+@track_db
+async def rollup_history(batch: int = ROLLUP_BATCH) -> int:
+    """Инкрементально свернуть новые строки game_history в корзины (на всех шардах).
+    Возвращает число свёрнутых строк."""
+    counts = await asyncio.gather(*(_rollup_shard(shard, batch) for shard in range(DB_SHARDS)))
+    return sum(counts)
+
+
+async def _rollup_shard(shard: int, batch: int) -> int:
+    """Свёртка одного шарда; каждая пачка — одна операция писателя"""
+    async def op(db):
+        cursor = await db.execute("SELECT last_id FROM rollup_state WHERE name = 'game_history'")
+        row = await cursor.fetchone()
+        last_id = row[0] if row else 0
+
+        cursor = await db.execute("""
+            SELECT COUNT(*), MAX(id) FROM (
+                SELECT id FROM game_history WHERE id > ? ORDER BY id LIMIT ?
+            )
+        """, (last_id, batch))
+        count, upto = await cursor.fetchone()
+        if not count:
+            return 0
+
+        for table, prefix in _ROLLUP_BUCKETS.items():
+            # WHERE в SELECT обязателен: иначе SQLite путает ON CONFLICT с JOIN
+            await db.execute(f"""
+                INSERT INTO {table} (bucket, mode, anime_id, was_correct, answers, xp_earned)
+                SELECT substr(played_at, 1, {prefix}), mode, anime_id, was_correct,
+                       COUNT(*), COALESCE(SUM(xp_earned), 0)
+                FROM game_history
+                WHERE id > ? AND id <= ?
+                GROUP BY 1, 2, 3, 4
+                ON CONFLICT (bucket, mode, anime_id, was_correct) DO UPDATE SET
+                    answers = answers + excluded.answers,
+                    xp_earned = xp_earned + excluded.xp_earned
+            """, (last_id, upto))
+        await db.execute("""
+            INSERT INTO rollup_state (name, last_id) VALUES ('game_history', ?)
+            ON CONFLICT(name) DO UPDATE SET last_id = excluded.last_id
+        """, (upto,))
+        return count
+
+    total = 0
+    while True:
+        count = await _write(op, shard)
+        total += count
+        if count < batch:
+            return total
+
+
+@track_db
+async def prune_history(
+    raw_days: int = HISTORY_RAW_DAYS,
+    hourly_days: int = HISTORY_HOURLY_DAYS,
+    batch: int = ROLLUP_BATCH,
+    archive_dir: str = HISTORY_ARCHIVE_DIR,
+) -> dict:
+    """Убрать из БД уже свёрнутые сырые строки старше raw_days (с архивом —
+    сначала дописав их в сегменты archive_dir) и почасовые корзины старше
+    hourly_days. Дневные корзины хранятся всегда."""
+    results = await asyncio.gather(*(
+        _prune_shard(
+            shard, raw_days, hourly_days, batch,
+            # id истории у каждого шарда свои — и архив свой
+            os.path.join(archive_dir, f"shard{shard}") if archive_dir and DB_SHARDS > 1 else archive_dir,
+        )
+        for shard in range(DB_SHARDS)
+    ))
+    return {key: sum(result[key] for result in results) for key in ("game_history", "history_hourly")}
+
+
+async def _prune_shard(shard: int, raw_days: int, hourly_days: int, batch: int, archive_dir: str) -> dict:
+    """Очистка одного шарда"""
+    deleted = {"game_history": 0, "history_hourly": 0}
+    async with _read(shard) as db:
+        cursor = await db.execute("SELECT last_id FROM rollup_state WHERE name = 'game_history'")
+        row = await cursor.fetchone()
+        rolled_up_id = row[0] if row else 0
+        cursor = await db.execute("SELECT datetime('now', ?)", (f"-{raw_days} days",))
+        (cutoff,) = await cursor.fetchone()
+
+    # Пачками по id: старые строки лежат в начале таблицы
+    while True:
+        async with _read(shard) as db:
+            cursor = await db.execute("""
+                SELECT id, user_id, mode, anime_id, was_correct, xp_earned,
+                       CAST(strftime('%s', played_at) AS INTEGER)
+                FROM game_history
+                WHERE id <= ? AND played_at < ?
+                ORDER BY id LIMIT ?
+            """, (rolled_up_id, cutoff, batch))
+            rows = await cursor.fetchall()
+        if not rows:
+            break
+
+        # Файл пишется до удаления: при сбое между ними строки попадут
+        # в архив повторно, а читатель архива пропустит дубли по id
+        if archive_dir:
+            await asyncio.to_thread(archive.append_rows, archive_dir, rows)
+
+        async def delete_rows(db, first=rows[0][0], last=rows[-1][0]):
+            cursor = await db.execute(
+                "DELETE FROM game_history WHERE id >= ? AND id <= ? AND played_at < ?",
+                (first, last, cutoff)
+            )
+            return cursor.rowcount
+        deleted["game_history"] += await _write(delete_rows, shard)
+        if len(rows) < batch:
+            break
+
+    async def delete_hourly(db):
         cursor = await db.execute(
-            "SELECT COUNT(*) FROM players WHERE last_played LIKE ?",
-            (f"{today}%",)
+            "DELETE FROM history_hourly WHERE bucket < strftime('%Y-%m-%d %H', 'now', ?)",
+            (f"-{hourly_days} days",)
         )
-        active_today = (await cursor.fetchone())[0]
+        return cursor.rowcount
+    deleted["history_hourly"] = await _write(delete_hourly, shard)
+    return deleted
+
+
+@track_db
+async def get_hardest_anime(
+    mode: str | None = None, days: int = 30, min_answers: int = 10, limit: int = 10
+) -> list:
+    """Аниме с самой низкой точностью за days дней (только по дневным свёрткам)"""
+    totals = _merge_sums(await _read_all("""
+        SELECT anime_id, SUM(answers), SUM(answers * was_correct)
+        FROM history_daily
+        WHERE bucket >= date('now', ?) AND (? IS NULL OR mode = ?)
+        GROUP BY anime_id
+    """, (f"-{days - 1} days", mode, mode)))
+    hardest = sorted(
+        ((anime_id, answers, correct) for anime_id, (answers, correct) in totals.items() if answers >= min_answers),
+        key=lambda item: (item[2] / item[1], -item[1]),
+    )[:limit]
+    return [
+        {"anime_id": anime_id, "answers": answers, "correct": correct, "accuracy": round(correct / answers * 100, 1)}
+        for anime_id, answers, correct in hardest
+    ]
+
+
+@track_db
+async def get_most_missed(mode: str | None = "quote", days: int = 30, limit: int = 10) -> list:
+    """Аниме с наибольшим числом ошибок за days дней (по умолчанию — в режиме цитат).
+    Считается по аниме, не по конкретной цитате: свёртки ключуются (mode, anime_id, was_correct)"""
+    totals = _merge_sums(await _read_all("""
+        SELECT anime_id, SUM(answers)
+        FROM history_daily
+        WHERE bucket >= date('now', ?) AND was_correct = 0 AND (? IS NULL OR mode = ?)
+        GROUP BY anime_id
+    """, (f"-{days - 1} days", mode, mode)))
+    missed = heapq.nlargest(limit, totals.items(), key=lambda item: item[1][0])
+    return [{"anime_id": anime_id, "wrong": wrong} for anime_id, (wrong,) in missed]
+
+
+@track_db
+async def get_anime_accuracy() -> dict:
+    """{anime_id: (ответов, правильных)} за всё время (по дневным свёрткам)"""
+    totals = _merge_sums(await _read_all("""
+        SELECT anime_id, SUM(answers), SUM(answers * was_correct)
+        FROM history_daily
+        GROUP BY anime_id
+    """))
+    return {anime_id: (answers, correct) for anime_id, (answers, correct) in totals.items()}
+
+
+@track_db
+async def get_hourly_activity(hours: int = 24) -> list:
+    """Ответы и точность по часам за последние hours часов (по почасовым свёрткам)"""
+    totals = _merge_sums(await _read_all("""
+        SELECT bucket, SUM(answers), SUM(answers * was_correct)
+        FROM history_hourly
+        WHERE bucket >= strftime('%Y-%m-%d %H', 'now', ?)
+        GROUP BY bucket
+    """, (f"-{hours - 1} hours",)))
+    return [
+        {"hour": hour, "answers": answers, "correct": correct}
+        for hour, (answers, correct) in sorted(totals.items())
+    ]
+
+
+# ============ ПУТАНИЦА (ПОДБОР ДИСТРАКТОРОВ) ============
+
+@track_db
+async def add_confusion(deltas: dict) -> int:
+    """Прибавить счётчики путаницы {(правильное, выбранное): раз}. Глобальные — пишутся в шард 0"""
+    if not deltas:
+        return 0
+
+    async def op(db):
+        await db.executemany("""
+            INSERT INTO anime_confusion (anime_id, chosen_id, picks) VALUES (?, ?, ?)
+            ON CONFLICT(anime_id, chosen_id) DO UPDATE SET picks = picks + excluded.picks
+        """, [(anime_id, chosen_id, picks) for (anime_id, chosen_id), picks in deltas.items()])
+    await _write(op, 0)
+    return len(deltas)
+
+
+@track_db
+async def get_confusion() -> dict:
+    """{правильное: {выбранное неверное: раз}} за всё время"""
+    confusion: dict[int, dict[int, int]] = {}
+    for rows in await _read_all("SELECT anime_id, chosen_id, picks FROM anime_confusion"):
+        for anime_id, chosen_id, picks in rows:
+            by_anime = confusion.setdefault(anime_id, {})
+            by_anime[chosen_id] = by_anime.get(chosen_id, 0) + picks
+    return confusion
 
-        cursor = await db.execute("SELECT SUM(games_played) FROM players")
-        total_games = (await cursor.fetchone())[0] or 0
 
-        cursor = await db.execute("SELECT SUM(correct_answers) FROM players")
-        total_correct = (await cursor.fetchone())[0] or 0
+# ============ СТАТИСТИКА (АДМИН) ============
 
-        return {
-            "total_players": total_players,
-            "active_today": active_today,
-            "total_games": total_games,
-            "total_correct": total_correct,
-        }
+@track_db
+async def get_bot_stats() -> dict:
+    """Получить статистику бота (сумма счётчиков шардов, без сканирования players)"""
+    counters = {
+        name: value for name, (value,) in _merge_sums(await _read_all("SELECT name, value FROM bot_counters")).items()
+    }
+
+    def split(prefix: str) -> dict:
+        """{ключ: {"answers", "correct", "accuracy"}} для mode:/rarity: счётчиков"""
+        result = {}
+        for name, value in counters.items():
+            if name.startswith(prefix):
+                key, kind = name[len(prefix):].rsplit(":", 1)
+                result.setdefault(key, {"answers": 0, "correct": 0})[kind] = value
+        for item in result.values():
+            item["accuracy"] = round(item["correct"] / item["answers"] * 100, 1) if item["answers"] else 0
+        return result
+
+    return {
+        "total_players": counters.get("players", 0),
+        "active": {window: activity.active(window) for window in activity.windows},
+        "total_games": counters.get("games", 0),
+        "total_correct": counters.get("correct", 0),
+        "answers_per_minute": activity.answers_per_minute(),
+        "modes": split("mode:"),
+        "rarities": split("rarity:"),
+    }
@@ -0,0 +1,143 @@
+"""
+✍️ Единственный писатель SQLite с групповым коммитом
+Все изменения БД идут через очередь: задача-писатель забирает всё, что
+накопилось, и выполняет одной транзакцией. Каждая операция — в своём
+SAVEPOINT (ошибка одной не откатывает остальные), future вызывающего
+завершается только после COMMIT. Пока писатель не запущен, операции
+выполняются напрямую, каждая в своей транзакции.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable
+
+import aiosqlite
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+Operation = Callable[[aiosqlite.Connection], Awaitable[Any]]
+
+WRITE_BATCH = metrics.Histogram(
+    "anime_db_write_batch_size", "Операций в одной транзакции писателя", ("db",),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+WRITE_QUEUE = metrics.Gauge("anime_db_write_queue", "Операций в очереди писателя", ("db",))
+
+
+class GroupCommitWriter:
+    """Очередь операций записи + задача, коммитящая их пачками"""
+
+    def __init__(self, connect: Callable[[], aiosqlite.Connection], name: str = "main", max_batch: int = 256):
+        self.connect = connect
+        self.name = name
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._db: aiosqlite.Connection | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self):
+        if self.running:
+            return
+        self._db = await self.connect()
+        self._queue = asyncio.Queue(maxsize=self.max_batch * 8)
+        self._task = asyncio.create_task(self._run())
+        WRITE_QUEUE.set_function(self._queue.qsize, db=self.name)
+
+    async def stop(self):
+        """Дописать всё из очереди и закрыть соединение"""
+        if not self.running:
+            return
+        task, self._task = self._task, None   # Новые операции — уже напрямую
+        await self._queue.put(None)
+        await task
+        await self._db.close()
+        self._db = None
+
+        # Операции, успевшие встать в очередь после сигнала остановки
+        while not self._queue.empty():
+            op, future = self._queue.get_nowait()
+            try:
+                future.set_result(await self._direct(op))
+            except Exception as e:
+                future.set_exception(e)
+
+    async def submit(self, op: Operation) -> Any:
+        """Выполнить op(db) в транзакции писателя; результат — после COMMIT"""
+        if not self.running:
+            return await self._direct(op)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((op, future))
+        return await future
+
+    async def _direct(self, op: Operation) -> Any:
+        async with self.connect() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            result = await op(db)
+            await db.commit()
+        metrics.DB_COMMITS.inc()
+        return result
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            await self._execute(batch)
+            if stop:
+                return
+
+    async def _execute(self, batch: list):
+        db = self._db
+        outcomes = []
+        try:
+            await db.execute("BEGIN IMMEDIATE")
+            for op, future in batch:
+                if future.done():      # Вызывающий уже отменил ожидание
+                    continue
+                await db.execute("SAVEPOINT op")
+                try:
+                    result = await op(db)
+                except Exception as e:
+                    await db.execute("ROLLBACK TO op")
+                    await db.execute("RELEASE op")
+                    outcomes.append((future, e, None))
+                else:
+                    await db.execute("RELEASE op")
+                    outcomes.append((future, None, result))
+            await db.commit()
+        except Exception as e:
+            logger.error(f"Group commit failed ({self.name}, {len(batch)} ops): {e}")
+            try:
+                await db.rollback()
+            except Exception:
+                pass
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        metrics.DB_COMMITS.inc()
+        WRITE_BATCH.observe(len(batch), db=self.name)
+        for future, error, result in outcomes:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
@@ -0,0 +1,90 @@
+"""
+🎲 Хранилище открытых игр
+Игра открывается вместе с таймером таймаута и закрывается ровно один раз:
+ответом (claim), таймаутом (expire) или новой игрой того же игрока — у
+игрока одна открытая игра, и все они показываются в одном сообщении. claim — синхронная операция без
+await внутри, поэтому два одновременных нажатия не могут забрать одну
+игру дважды. Недавно закрытые игры помнятся какое-то время, чтобы на
+повторное нажатие ответить молча, а не «игра устарела».
+"""
+import time
+import uuid
+from collections import OrderedDict
+
+from timerwheel import TimingWheel
+
+# Результаты claim
+CLAIMED = "claimed"     # Игра наша — можно засчитывать ответ
+ANSWERED = "answered"   # Уже закрыта ответом (двойное нажатие)
+MISSING = "missing"     # Нет такой (таймаут, рестарт бота)
+FOREIGN = "foreign"     # Чужая игра
+
+
+class GameStore:
+    """game_id -> данные игры + таймеры таймаутов"""
+
+    def __init__(self, timers: TimingWheel, closed_ttl: float = 60, max_closed: int = 100_000):
+        self.timers = timers
+        self.closed_ttl = closed_ttl
+        self.max_closed = max_closed
+        self._games: dict[str, dict] = {}
+        self._by_user: dict[int, str] = {}    # user_id -> его открытая игра
+        self._closed: OrderedDict[str, float] = OrderedDict()   # game_id -> когда закрыта ответом
+
+    def __len__(self) -> int:
+        return len(self._games)
+
+    def __contains__(self, game_id: str) -> bool:
+        return game_id in self._games
+
+    def get(self, game_id: str) -> dict | None:
+        return self._games.get(game_id)
+
+    def open(self, game_data: dict, timeout: float) -> str:
+        """Открыть игру и поставить таймаут через timeout секунд. Возвращает game_id.
+        Прежняя открытая игра игрока закрывается без таймаута"""
+        previous = self._by_user.get(game_data["user_id"])
+        if previous is not None:
+            self.discard(previous)
+        game_id = uuid.uuid4().hex[:8]
+        while game_id in self._games:
+            game_id = uuid.uuid4().hex[:8]
+        self._games[game_id] = game_data
+        self._by_user[game_data["user_id"]] = game_id
+        self.timers.schedule(game_id, timeout)
+        return game_id
+
+    def claim(self, game_id: str, user_id: int) -> tuple[str, dict | None]:
+        """Атомарно забрать игру под ответ: (результат, игра)"""
+        game = self._games.get(game_id)
+        if game is None:
+            return (ANSWERED if game_id in self._closed else MISSING), None
+        if game["user_id"] != user_id:
+            return FOREIGN, None
+        self._close(game_id)
+        self.timers.cancel(game_id)
+        self._remember_closed(game_id)
+        return CLAIMED, game
+
+    def expire(self, game_ids) -> list:
+        """Закрыть игры по таймауту (колбэк колеса таймеров). Возвращает закрытые"""
+        return [game for game in (self._close(game_id) for game_id in game_ids) if game]
+
+    def discard(self, game_id: str):
+        """Убрать игру без ответа и таймаута"""
+        if self._close(game_id) is not None:
+            self.timers.cancel(game_id)
+
+    def _close(self, game_id: str) -> dict | None:
+        game = self._games.pop(game_id, None)
+        if game is not None and self._by_user.get(game["user_id"]) == game_id:
+            del self._by_user[game["user_id"]]
+        return game
+
+    def _remember_closed(self, game_id: str):
+        now = time.monotonic()
+        self._closed[game_id] = now
+        while self._closed and (
+            len(self._closed) > self.max_closed or next(iter(self._closed.values())) < now - self.closed_ttl
+        ):
+            self._closed.popitem(last=False)
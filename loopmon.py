@@ -0,0 +1,101 @@
+"""
+🫀 Мониторинг event loop: задержка планирования и зависания
+Тикер раз в interval засыпает и меряет, насколько позже проснулся (lag).
+Сторожевой поток замечает, что тикер давно не отмечался, и снимает стек
+потока event loop — это и есть код, который блокирует цикл.
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = metrics.Histogram(
+    "anime_loop_lag_seconds", "Задержка планирования event loop",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+LOOP_STALLS = metrics.Counter("anime_loop_stalls_total", "Зависания event loop дольше порога")
+LOOP_LAG_MAX = metrics.Gauge("anime_loop_lag_max_seconds", "Максимальная задержка event loop")
+
+
+class LoopMonitor:
+    def __init__(self, interval: float = 0.25, stall_threshold: float = 0.1, window: int = 240):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.lags: deque = deque(maxlen=window)   # последние замеры (для p99 в /stats)
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.last_stall: dict | None = None
+        self._heartbeat = time.monotonic()
+        self._stall_reported = False
+        self._loop_thread_id = 0
+        self._stop = threading.Event()
+        self._watchdog: threading.Thread | None = None
+
+    async def run(self, debug_slow_callbacks: bool = False):
+        """Тикер + сторожевой поток; работает до отмены задачи"""
+        loop = asyncio.get_running_loop()
+        if debug_slow_callbacks:
+            # Встроенные отчёты asyncio о медленных колбэках (дорогой debug-режим)
+            loop.set_debug(True)
+            loop.slow_callback_duration = self.stall_threshold
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        LOOP_LAG_MAX.set_function(lambda: self.max_lag)
+        try:
+            while True:
+                expected = loop.time() + self.interval
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, loop.time() - expected)
+                self.lags.append(lag)
+                self.max_lag = max(self.max_lag, lag)
+                LOOP_LAG.observe(lag)
+                self._heartbeat = time.monotonic()
+                self._stall_reported = False
+        finally:
+            self._stop.set()
+            self._watchdog.join()
+            self._watchdog = None
+
+    def _watch(self):
+        limit = self.interval + self.stall_threshold
+        while not self._stop.wait(self.stall_threshold / 2):
+            blocked_for = time.monotonic() - self._heartbeat
+            if blocked_for < limit or self._stall_reported:
+                continue
+            self._stall_reported = True
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+            self.stalls += 1
+            LOOP_STALLS.inc()
+            self.last_stall = {
+                "at": time.time(),
+                "blocked_ms": round((blocked_for - self.interval) * 1000),
+                "where": (
+                    f"{frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}"
+                    if frame is not None else "?"
+                ),
+            }
+            logger.warning(
+                f"Event loop blocked for >{self.last_stall['blocked_ms']} ms, loop thread stack:\n{stack}"
+            )
+
+    def stats(self) -> dict:
+        lags = sorted(self.lags)
+        p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))] if lags else 0.0
+        return {
+            "lag_last_ms": (self.lags[-1] if self.lags else 0.0) * 1000,
+            "lag_p99_ms": p99 * 1000,
+            "lag_max_ms": self.max_lag * 1000,
+            "stalls": self.stalls,
+            "last_stall": self.last_stall,
+        }
@@ -0,0 +1,234 @@
+"""
+📈 Метрики бота в формате Prometheus (без внешних зависимостей)
+Гистограммы задержек обработчиков, БД и Jikan, счётчики и gauges,
+отдаются по HTTP на /metrics
+"""
+import functools
+import logging
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiohttp import web
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY: list = []
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    """{a="1",b="2"} для строки экспозиции"""
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Монотонный счётчик"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self._key(labels), 0)
+
+    def render(self) -> list:
+        lines = super().render()
+        for key, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Текущее значение (можно вычислять в момент запроса метрик)"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: dict[tuple, float] = {}
+        self.functions: dict[tuple, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, func: Callable[[], float], **labels):
+        self.functions[self._key(labels)] = func
+
+    def get(self, **labels) -> float:
+        key = self._key(labels)
+        if key in self.functions:
+            return self.functions[key]()
+        return self.values.get(key, 0)
+
+    def render(self) -> list:
+        lines = super().render()
+        values = dict(self.values)
+        for key, func in self.functions.items():
+            try:
+                values[key] = func()
+            except Exception as e:
+                logger.error(f"Gauge {self.name} callback error: {e}")
+        for key, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными корзинами"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.series: dict[tuple, list] = {}   # key -> [counts по корзинам (+Inf последняя), sum]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def count(self, **labels) -> int:
+        series = self.series.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def render(self) -> list:
+        lines = super().render()
+        for key, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ============ МЕТРИКИ БОТА ============
+
+HANDLER_LATENCY = Histogram(
+    "anime_handler_seconds", "Время обработки апдейта по обработчикам", ("handler",)
+)
+DB_LATENCY = Histogram(
+    "anime_db_call_seconds", "Время вызовов database.*", ("function",)
+)
+DB_COMMITS = Counter("anime_db_commits_total", "Количество COMMIT в SQLite")
+JIKAN_LATENCY = Histogram("anime_jikan_request_seconds", "Время запросов к Jikan API")
+JIKAN_RESPONSES = Counter("anime_jikan_responses_total", "Ответы Jikan по HTTP-статусу", ("status",))
+IMAGE_CACHE = Counter("anime_image_cache_total", "Попадания/промахи кеша картинок", ("result",))
+PREPARED_GAMES = Counter(
+    "anime_prepared_games_total", "Заготовленные следующие игры: использована/нет/устарела/другой режим", ("result",)
+)
+ACTIVE_GAMES = Gauge("anime_active_games", "Количество незавершённых игр в памяти")
+GAME_TIMEOUTS = Counter("anime_game_timeouts_total", "Игры, на которые не ответили вовремя")
+
+
+def observe(histogram: Histogram, **labels):
+    """Декоратор: записать время выполнения корутины в гистограмму"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+
+def track_db(func):
+    """Декоратор для функций database.*: гистограмма + спан трассировки"""
+    name = func.__name__
+    span_name = f"db:{name}"
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            with tracing.span(span_name):
+                return await func(*args, **kwargs)
+        finally:
+            DB_LATENCY.observe(time.perf_counter() - start, function=name)
+    return wrapper
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время работы каждого обработчика (регистрируется как inner middleware)"""
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - start, handler=name)
+
+
+# ============ HTTP /metrics ============
+
+async def _metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_server(host: str, port: int) -> web.AppRunner:
+    """Поднять HTTP-сервер с /metrics"""
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"📈 Метрики: http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,211 @@
+"""
+🧱 Middleware диспетчера: защита обработчиков от лишней работы
+Дедупликация повторных апдейтов, почтовые ящики игроков (апдейты одного
+игрока — строго по очереди, разных — параллельно) и контроль допуска:
+не больше N обработчиков сразу, остальные ждут в ограниченных очередях
+по классам, а при переполнении получают «занято».
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Sequence
+
+from aiogram import BaseMiddleware
+
+import metrics
+import tracing
+
+DUPLICATE_UPDATES = metrics.Counter(
+    "anime_duplicate_updates_total", "Отброшенные повторные апдейты", ("kind",)
+)
+MAILBOXES = metrics.Gauge("anime_user_mailboxes", "Игроки с апдейтами в обработке или в очереди")
+MAILBOX_WAIT = metrics.Histogram(
+    "anime_mailbox_wait_seconds", "Ожидание апдейта в очереди своего игрока",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+ADMISSION_INFLIGHT = metrics.Gauge("anime_admission_inflight", "Обработчиков апдейтов в работе")
+ADMISSION_QUEUE = metrics.Gauge("anime_admission_queue", "Апдейтов в очереди на допуск", ("kind",))
+ADMISSION_WAIT = metrics.Histogram(
+    "anime_admission_wait_seconds", "Ожидание допуска к обработке", ("kind",),
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+ADMISSION_SHED = metrics.Counter(
+    "anime_admission_shed_total", "Апдейты, отброшенные при перегрузке", ("kind", "reason")
+)
+
+
+class RecentKeys:
+    """Ограниченное множество ключей, каждый живёт ttl секунд"""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._seen: OrderedDict[Any, float] = OrderedDict()   # ключ -> когда увиден
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def add(self, key) -> bool:
+        """Добавить ключ. False — он уже был в окне"""
+        now = time.monotonic()
+        while self._seen and (
+            len(self._seen) >= self.max_size or next(iter(self._seen.values())) < now - self.ttl
+        ):
+            self._seen.popitem(last=False)
+        if key in self._seen:
+            return False
+        self._seen[key] = now
+        return True
+
+
+class DedupeMiddleware(BaseMiddleware):
+    """Outer middleware для dp.update: повторно доставленные апдейты (тот же
+    update_id) и повторы callback-запроса (тот же callback_query.id) не обрабатываются"""
+
+    def __init__(self, ttl: float = 300, max_size: int = 200_000):
+        self.updates = RecentKeys(ttl, max_size)
+        self.callbacks = RecentKeys(ttl, max_size)
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: dict[str, Any],
+    ) -> Any:
+        if not self.updates.add(event.update_id):
+            DUPLICATE_UPDATES.inc(kind="update")
+            return None
+        callback = event.callback_query
+        if callback is not None and not self.callbacks.add(callback.id):
+            DUPLICATE_UPDATES.inc(kind="callback")
+            return None
+        return await handler(event, data)
+
+
+class _Mailbox:
+    __slots__ = ("lock", "pending")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()   # Очередь FIFO: апдейты выполняются в порядке прихода
+        self.pending = 0
+
+
+class UserMailboxMiddleware(BaseMiddleware):
+    """Outer middleware для dp.update: апдейты одного игрока — по одному.
+    Ящик заводится на первый апдейт и удаляется, когда очередь опустела"""
+
+    def __init__(self):
+        self._boxes: dict[int, _Mailbox] = {}
+        MAILBOXES.set_function(lambda: len(self._boxes))
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        box = self._boxes.get(user.id)
+        if box is None:
+            box = self._boxes[user.id] = _Mailbox()
+        box.pending += 1
+        try:
+            start = time.monotonic()
+            with tracing.span("mailbox_wait"):
+                await box.lock.acquire()
+            MAILBOX_WAIT.observe(time.monotonic() - start)
+            try:
+                return await handler(event, data)
+            finally:
+                box.lock.release()
+        finally:
+            box.pending -= 1
+            if not box.pending:
+                del self._boxes[user.id]
+
+
+class AdmissionMiddleware(BaseMiddleware):
+    """Outer middleware для dp.update: не больше limit обработчиков одновременно.
+    Остальные ждут в очереди своего класса (0 — самый важный, освободившийся
+    слот достаётся ему первым). Полная очередь или ожидание дольше max_wait —
+    апдейт отбрасывается, на нажатие кнопки отвечаем busy_text"""
+
+    def __init__(self, classify: Callable[[Any], int], limit: int, queue_sizes: Sequence[int],
+                 class_names: Sequence[str], max_wait: float = 5.0, busy_text: str = "busy"):
+        self.classify = classify
+        self.limit = limit            # 0 — без ограничения
+        self.queue_sizes = queue_sizes
+        self.class_names = class_names
+        self.max_wait = max_wait
+        self.busy_text = busy_text
+        self.running = 0
+        self._queues: list[deque] = [deque() for _ in queue_sizes]
+        ADMISSION_INFLIGHT.set_function(lambda: self.running)
+        for name, queue in zip(class_names, self._queues):
+            ADMISSION_QUEUE.set_function(lambda q=queue: len(q), kind=name)
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: dict[str, Any],
+    ) -> Any:
+        if not await self._admit(event):
+            return None
+        try:
+            return await handler(event, data)
+        finally:
+            self._release()
+
+    async def _admit(self, event) -> bool:
+        """Занять слот (сразу или дождавшись очереди). False — апдейт отброшен"""
+        if not self.limit or (self.running < self.limit and not any(self._queues)):
+            self.running += 1
+            return True
+
+        klass = self.classify(event)
+        name = self.class_names[klass]
+        queue = self._queues[klass]
+        if len(queue) >= self.queue_sizes[klass]:
+            await self._shed(event, name, "queue_full")
+            return False
+
+        # Слот передаёт освободивший его обработчик (running не меняется)
+        future = asyncio.get_running_loop().create_future()
+        queue.append(future)
+        start = time.monotonic()
+        try:
+            with tracing.span("admission_wait", kind=name):
+                await asyncio.wait([future], timeout=self.max_wait)
+        except asyncio.CancelledError:
+            if future.done():
+                self._release()     # Слот уже наш — отдаём дальше
+            else:
+                queue.remove(future)
+            raise
+        ADMISSION_WAIT.observe(time.monotonic() - start, kind=name)
+        if not future.done():
+            queue.remove(future)
+            await self._shed(event, name, "timeout")
+            return False
+        return True
+
+    def _release(self):
+        """Освободить слот: первому ожидающему по порядку классов"""
+        for queue in self._queues:
+            if queue:
+                queue.popleft().set_result(None)
+                return
+        self.running -= 1
+
+    async def _shed(self, event, name: str, reason: str):
+        ADMISSION_SHED.inc(kind=name, reason=reason)
+        callback = getattr(event, "callback_query", None)
+        if callback is not None:
+            try:
+                await callback.answer(self.busy_text)
+            except Exception:
+                pass    # Нажатие могло устареть — ответ «занято» не важен
@@ -0,0 +1,100 @@
+"""
+🔀 Разбить однофайловую БД на шарды по user_id
+    python migrate_shards.py --shards 4                 # anime_game.db -> anime_game.0.db ... anime_game.3.db
+    python migrate_shards.py --shards 4 --source old.db --force
+Бот должен быть остановлен. Исходный файл не удаляется; после переноса
+запускай бота с DB_SHARDS=<N>.
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+
+import config
+import database as db
+
+# Таблицы с данными игроков — строки уезжают в шард своего user_id
+USER_TABLES = ("players", "collection", "achievements", "game_history")
+# Глобальные агрегаты — целиком в шард 0 (запросы суммируют шарды)
+GLOBAL_TABLES = ("bot_counters", "history_hourly", "history_daily", "anime_confusion")
+
+
+def _columns(conn: sqlite3.Connection, table: str, schema: str = "main") -> list:
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def migrate(source: str, shards: int, force: bool = False) -> list:
+    """Перенести source в shards файлов. Возвращает [(путь, {таблица: строк})]"""
+    # Схема исходника — до актуальной версии (миграции колонок, счётчики)
+    db.DATABASE_PATH, db.DB_SHARDS = source, 1
+    asyncio.run(db.init_db())
+
+    db.DB_SHARDS = shards
+    targets = [db.shard_path(shard) for shard in range(shards)]
+    existing = [path for path in targets if os.path.exists(path)]
+    if existing:
+        if not force:
+            raise SystemExit(f"Файлы шардов уже существуют: {', '.join(existing)} (--force — перезаписать)")
+        for path in existing:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+    asyncio.run(db.init_db())
+
+    report = []
+    for shard, path in enumerate(targets):
+        conn = sqlite3.connect(path)
+        conn.execute("ATTACH DATABASE ? AS src", (source,))
+        counts = {}
+        for table in USER_TABLES:
+            columns = [c for c in _columns(conn, table) if c in set(_columns(conn, table, "src"))]
+            names = ", ".join(columns)
+            cursor = conn.execute(
+                f"INSERT INTO {table} ({names}) SELECT {names} FROM src.{table} WHERE user_id % ? = ?",
+                (shards, shard)
+            )
+            counts[table] = cursor.rowcount
+
+        if shard == 0:
+            for table in GLOBAL_TABLES:
+                conn.execute(f"DELETE FROM {table}")
+                conn.execute(f"INSERT INTO {table} SELECT * FROM src.{table}")
+
+        # Свёрнутое до переноса уже лежит в свёртках шарда 0: у всех шардов
+        # та же отметка, а новые id истории начинаются после старых
+        conn.execute("DELETE FROM rollup_state")
+        conn.execute("INSERT INTO rollup_state SELECT * FROM src.rollup_state")
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = 'game_history'")
+        conn.execute("""
+            INSERT INTO sqlite_sequence (name, seq) VALUES ('game_history', MAX(
+                COALESCE((SELECT seq FROM src.sqlite_sequence WHERE name = 'game_history'), 0),
+                COALESCE((SELECT MAX(last_id) FROM src.rollup_state), 0)
+            ))
+        """)
+        conn.commit()
+        conn.execute("DETACH DATABASE src")
+        conn.close()
+        report.append((path, counts))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Разбить БД бота на шарды по user_id")
+    parser.add_argument("--shards", type=int, required=True, help="число шардов (>1)")
+    parser.add_argument("--source", default=config.DATABASE_PATH, help="исходный файл БД")
+    parser.add_argument("--force", action="store_true", help="перезаписать существующие шарды")
+    args = parser.parse_args()
+
+    if args.shards < 2:
+        raise SystemExit("--shards должно быть больше 1")
+    if not os.path.exists(args.source):
+        raise SystemExit(f"Нет файла {args.source}")
+
+    for path, counts in migrate(args.source, args.shards, args.force):
+        print(f"✅ {path}: " + ", ".join(f"{table} {count}" for table, count in counts.items()))
+    print(f"Готово. Запускай бота с DB_SHARDS={args.shards}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""
+🚦 Планировщик исходящих вызовов Telegram
+Middleware сессии бота: все отправки, правки и удаления сообщений проходят
+через общий лимит (~30/с на бота) и лимит на чат, по приоритетам —
+результаты ответов раньше меню. На TelegramRetryAfter чат (или весь бот)
+ставится на паузу на retry_after и вызов повторяется. Правка сообщения,
+которую до отправки вытеснила более новая правка того же сообщения,
+не отправляется: её вызывающий получает результат новой.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+import metrics
+
+# Приоритеты (меньше — раньше)
+PRIORITY_ANSWER = 0   # Результат ответа
+PRIORITY_GAME = 1     # Новый вопрос
+PRIORITY_VIEW = 2     # Меню, профиль, топ и прочее
+
+_priority: ContextVar[int] = ContextVar("outbound_priority", default=PRIORITY_VIEW)
+
+# Методы, на которые действуют лимиты Telegram (answerCallbackQuery и служебные — без очереди)
+SCHEDULED_PREFIXES = ("send", "edit", "delete", "copy", "forward")
+
+OUTBOUND_WAIT = metrics.Histogram(
+    "anime_outbound_wait_seconds", "Ожидание вызова Bot API в планировщике", ("priority",),
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+OUTBOUND_QUEUE = metrics.Gauge("anime_outbound_queue", "Вызовов Bot API в очереди на общий лимит")
+OUTBOUND_RETRY_AFTER = metrics.Counter("anime_outbound_retry_after_total", "Ответы TelegramRetryAfter")
+OUTBOUND_COALESCED = metrics.Counter("anime_outbound_coalesced_total", "Правки, вытесненные более новой правкой")
+
+
+class _Rate:
+    """Лимит rate/с с запасом burst (GCRA) и паузой после retry_after"""
+    __slots__ = ("interval", "tolerance", "tat", "paused_until")
+
+    def __init__(self, rate: float, burst: int):
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self.tolerance = self.interval * max(burst - 1, 0)
+        self.tat = 0.0            # Теоретическое время следующего вызова
+        self.paused_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд можно сделать вызов"""
+        return max(self.tat - self.tolerance, self.paused_until, now) - now
+
+    def take(self, now: float):
+        self.tat = max(self.tat, now) + self.interval
+
+
+class _Waiter:
+    __slots__ = ("priority", "chat_id", "granted", "result")
+
+    def __init__(self, priority: int, chat_id):
+        self.priority = priority
+        self.chat_id = chat_id
+        # True — можно отправлять; другой _Waiter — правку вытеснили, ждём его результат
+        self.granted: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.result: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Общий лимит по приоритетам + лимиты чатов + retry_after + слияние правок"""
+
+    def __init__(self, rate: float = 30, burst: int = 30, chat_rate: float = 1.0, chat_burst: int = 3,
+                 max_retries: int = 3, max_chats: int = 100_000):
+        self.rate = _Rate(rate, burst)
+        self.chat_rate, self.chat_burst = chat_rate, chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chats: dict[Any, _Rate] = {}
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._edits: dict[tuple, _Waiter] = {}   # (chat_id, message_id) -> последняя правка в очереди
+        self._wakeup: asyncio.Event | None = None
+        self._pump: asyncio.Task | None = None
+        OUTBOUND_QUEUE.set_function(lambda: len(self._heap))
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        if not name.startswith(SCHEDULED_PREFIXES):
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        message_id = getattr(method, "message_id", None)
+        key = (chat_id, message_id) if name.startswith("edit") and message_id is not None else None
+        priority = _priority.get()
+
+        waiter = _Waiter(priority, chat_id)
+        if key is not None:
+            previous = self._edits.get(key)
+            if previous is not None and not previous.granted.done():
+                previous.granted.set_result(waiter)
+            self._edits[key] = waiter
+        try:
+            result = await self._call(make_request, bot, method, waiter)
+        except BaseException as e:
+            self._finish(key, waiter, error=e)
+            raise
+        self._finish(key, waiter, result=result)
+        return result
+
+    async def _call(self, make_request, bot, method, waiter: "_Waiter"):
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                waiter.granted = asyncio.get_running_loop().create_future()
+            start = time.monotonic()
+            granted = await self._acquire(waiter)
+            OUTBOUND_WAIT.observe(time.monotonic() - start, priority=waiter.priority)
+            if granted is not True:
+                # Правку вытеснила более новая правка того же сообщения
+                OUTBOUND_COALESCED.inc()
+                return await asyncio.shield(granted.result)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                OUTBOUND_RETRY_AFTER.inc()
+                limit = self._chat(waiter.chat_id) if waiter.chat_id is not None else self.rate
+                limit.paused_until = max(limit.paused_until, time.monotonic() + e.retry_after)
+                if attempt == self.max_retries:
+                    raise
+
+    # ============ ОЧЕРЕДЬ ============
+
+    def _chat(self, chat_id) -> _Rate:
+        limit = self._chats.get(chat_id)
+        if limit is None:
+            if len(self._chats) >= self.max_chats:
+                # Чаты, чей лимит давно восстановился, можно забыть
+                now = time.monotonic()
+                for stale in [c for c, r in self._chats.items() if r.delay(now) <= 0 and r.tat < now]:
+                    del self._chats[stale]
+            limit = self._chats[chat_id] = _Rate(self.chat_rate, self.chat_burst)
+        return limit
+
+    async def _acquire(self, waiter: _Waiter):
+        """Дождаться лимита чата, затем очереди на общий лимит. True или вытеснивший _Waiter"""
+        limit = None
+        if waiter.chat_id is not None:
+            # Без лимита на чат всё равно соблюдаем паузу после retry_after
+            limit = self._chat(waiter.chat_id) if self.chat_rate > 0 else self._chats.get(waiter.chat_id)
+        if limit is not None:
+            now = time.monotonic()
+            delay = limit.delay(now)
+            limit.take(now + delay)
+            if delay > 0:
+                await asyncio.wait([waiter.granted], timeout=delay)
+                if waiter.granted.done():
+                    return waiter.granted.result()
+
+        if self._pump is None or self._pump.done():
+            self._wakeup = asyncio.Event()
+            self._pump = asyncio.create_task(self._run())
+        heapq.heappush(self._heap, (waiter.priority, next(self._seq), waiter))
+        self._wakeup.set()
+        return await waiter.granted
+
+    async def _run(self):
+        """Выдавать слоты общего лимита: сначала меньший приоритет, внутри — по очереди"""
+        while True:
+            while self._heap and self._heap[0][2].granted.done():
+                heapq.heappop(self._heap)      # Вытеснена или вызывающий отменил ожидание
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = self.rate.delay(time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, waiter = heapq.heappop(self._heap)
+            if not waiter.granted.done():
+                self.rate.take(time.monotonic())
+                waiter.granted.set_result(True)
+
+    def _finish(self, key, waiter: _Waiter, result=None, error: BaseException | None = None):
+        """Отдать результат вытесненным правкам и снять правку из очереди"""
+        if not waiter.granted.done():
+            waiter.granted.cancel()     # Отменили в очереди — слот не нужен
+        if error is not None:
+            waiter.result.set_exception(error)
+            waiter.result.exception()   # Не ругаться, если вытесненных не было
+        else:
+            waiter.result.set_result(result)
+        if key is not None and self._edits.get(key) is waiter:
+            del self._edits[key]
+
+    async def close(self):
+        if self._pump is not None:
+            self._pump.cancel()
+            await asyncio.gather(self._pump, return_exceptions=True)
+            self._pump = None
+
+
+class OutboundPriorityMiddleware(BaseMiddleware):
+    """Middleware диспетчера: приоритет исходящих вызовов на время обработчика"""
+
+    def __init__(self, classify: Callable[[Any], int]):
+        self.classify = classify
+
+    async def __call__(self, handler: Callable[[Any, dict], Awaitable[Any]], event, data: dict):
+        token = _priority.set(self.classify(event))
+        try:
+            return await handler(event, data)
+        finally:
+            _priority.reset(token)
@@ -0,0 +1,231 @@
+"""
+🧠 Состояние игроков в памяти для быстрого ответа
+Снимок игрока (строка players + открытые достижения + собранные аниме)
+держится в LRU-кеше: исход ответа считается по нему без обращений к БД,
+а запись в БД уходит в фоновую очередь — по порядку для каждого игрока,
+с повторами при ошибках.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+import metrics
+from anime_data import ACHIEVEMENTS, ANIME_BY_ID, RARITY_COMMON, RARITY_RARE, RARITY_EPIC, RARITY_LEGENDARY
+
+logger = logging.getLogger(__name__)
+
+ALL_RARITIES = {RARITY_COMMON, RARITY_RARE, RARITY_EPIC, RARITY_LEGENDARY}
+
+PERSIST_QUEUE = metrics.Gauge("anime_persist_pending", "Фоновых записей в БД в очереди")
+PERSIST_FAILURES = metrics.Counter("anime_persist_failures_total", "Записи в БД, не прошедшие после всех повторов")
+
+
+# ============ ДОСТИЖЕНИЯ (ЧИСТАЯ ПРОВЕРКА) ============
+
+def achievement_checks(player: dict, rarities: set, extra: dict | None = None) -> dict:
+    """{achievement_id: выполнено ли условие} по данным игрока"""
+    extra = extra or {}
+    total = player["correct_answers"] + player["wrong_answers"]
+    collection_count = player["collection_count"]
+    return {
+        "first_win": player["correct_answers"] >= 1,
+        "correct_10": player["correct_answers"] >= 10,
+        "correct_50": player["correct_answers"] >= 50,
+        "correct_100": player["correct_answers"] >= 100,
+        "correct_200": player["correct_answers"] >= 200,
+        "streak_5": player["max_streak"] >= 5,
+        "streak_10": player["max_streak"] >= 10,
+        "streak_20": player["max_streak"] >= 20,
+        "games_10": player["games_played"] >= 10,
+        "games_100": player["games_played"] >= 100,
+        "games_500": player["games_played"] >= 500,
+        "image_25": player["correct_by_image"] >= 25,
+        "image_50": player["correct_by_image"] >= 50,
+        "quote_25": player["correct_by_quote"] >= 25,
+        "quote_50": player["correct_by_quote"] >= 50,
+        "daily_3": player["daily_streak"] >= 3,
+        "daily_7": player["daily_streak"] >= 7,
+        "daily_30": player["daily_streak"] >= 30,
+        "speed_demon": extra.get("speed_answer", False),
+        "legendary_guess": extra.get("guessed_legendary", False),
+        "collect_10": collection_count >= 10,
+        "collect_30": collection_count >= 30,
+        "collect_50": collection_count >= 50,
+        "all_rarities": rarities >= ALL_RARITIES,
+        # Безупречный — 10+ игр, 100% точность
+        "perfect_10": total >= 10 and player["wrong_answers"] == 0,
+    }
+
+
+def evaluate_achievements(player: dict, unlocked: set, rarities: set, extra: dict | None = None) -> list:
+    """Какие достижения только что выполнены (ещё не открытые)"""
+    return [
+        ach_id for ach_id, condition in achievement_checks(player, rarities, extra).items()
+        if condition and ach_id in ACHIEVEMENTS and ach_id not in unlocked
+    ]
+
+
+# ============ СНИМОК ИГРОКА ============
+
+class PlayerSnapshot:
+    """Строка players + множества открытых достижений, собранных аниме и их редкостей"""
+    __slots__ = ("player", "achievements", "collection", "rarities")
+
+    def __init__(self, player: dict, achievements: set, collection: set):
+        self.player = player
+        self.achievements = achievements
+        self.collection = collection
+        self.rarities = {ANIME_BY_ID[a]["rarity"] for a in collection if a in ANIME_BY_ID}
+
+    def apply_correct(self, mode: str, anime_id: int, xp_earned: int, now: str) -> bool:
+        """Правильный ответ (как record_correct_answer). Возвращает True, если аниме новое в коллекции"""
+        p = self.player
+        is_new = anime_id not in self.collection
+        if is_new:
+            self.collection.add(anime_id)
+            if anime_id in ANIME_BY_ID:
+                self.rarities.add(ANIME_BY_ID[anime_id]["rarity"])
+        p["correct_answers"] += 1
+        p["streak"] += 1
+        p["max_streak"] = max(p["max_streak"], p["streak"])
+        p["games_played"] += 1
+        p["correct_by_image" if mode == "image" else "correct_by_quote"] += 1
+        p["xp"] += xp_earned
+        p["last_played"] = now
+        p["collection_count"] += int(is_new)
+        return is_new
+
+    def apply_wrong(self, now: str):
+        """Неправильный ответ (как record_wrong_answer)"""
+        p = self.player
+        p["wrong_answers"] += 1
+        p["streak"] = 0
+        p["games_played"] += 1
+        p["last_played"] = now
+
+    def unlock(self, achievement_ids: list) -> dict:
+        """Открыть достижения и начислить награды. Возвращает {id: reward_xp}"""
+        rewards = {}
+        for ach_id in achievement_ids:
+            if ach_id in self.achievements:
+                continue
+            self.achievements.add(ach_id)
+            rewards[ach_id] = ACHIEVEMENTS[ach_id]["reward_xp"]
+            self.player["xp"] += rewards[ach_id]
+            self.player["achievements_count"] += 1
+        return rewards
+
+
+class SnapshotCache:
+    """LRU-кеш снимков; загрузка — loader(user_id) -> PlayerSnapshot | None"""
+
+    def __init__(self, loader: Callable[[int], Awaitable["PlayerSnapshot | None"]], writes: "UserWriteQueue",
+                 max_size: int = 50_000):
+        self.loader = loader
+        self.writes = writes
+        self.max_size = max_size
+        self._items: OrderedDict[int, PlayerSnapshot] = OrderedDict()
+        self._loading: dict[int, asyncio.Future] = {}
+
+    def peek(self, user_id: int) -> PlayerSnapshot | None:
+        return self._items.get(user_id)
+
+    async def get(self, user_id: int) -> PlayerSnapshot | None:
+        snapshot = self._items.get(user_id)
+        if snapshot is not None:
+            self._items.move_to_end(user_id)
+            return snapshot
+
+        # Один загрузчик на игрока, остальные ждут его результат
+        loading = self._loading.get(user_id)
+        if loading is not None:
+            return await asyncio.shield(loading)
+        future = self._loading[user_id] = asyncio.get_running_loop().create_future()
+        try:
+            # Сначала дописываем хвост записей игрока — иначе снимок устареет
+            await self.writes.wait(user_id)
+            snapshot = await self.loader(user_id)
+            if snapshot is not None:
+                self._items[user_id] = snapshot
+                while len(self._items) > self.max_size:
+                    self._items.popitem(last=False)
+            future.set_result(snapshot)
+            return snapshot
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()   # Не ругаться на «неполученное» исключение, если никто не ждал
+            raise
+        finally:
+            del self._loading[user_id]
+
+    def invalidate(self, user_id: int):
+        self._items.pop(user_id, None)
+
+    def snapshots(self):
+        return self._items.values()
+
+
+# ============ ФОНОВАЯ ЗАПИСЬ ============
+
+class UserWriteQueue:
+    """Фоновые записи: по порядку для каждого игрока, с повторами"""
+
+    def __init__(self, retries: int = 5, base_delay: float = 0.5):
+        self.retries = retries
+        self.base_delay = base_delay
+        self._tails: dict[int, asyncio.Task] = {}
+        self.pending = 0
+        PERSIST_QUEUE.set_function(lambda: self.pending)
+
+    def submit(self, user_id: int, make_coro: Callable[[], Awaitable[Any]],
+               on_failure: Callable[[], None] | None = None) -> asyncio.Task:
+        """Поставить запись в очередь игрока. make_coro вызывается на каждую попытку"""
+        return self.submit_many((user_id,), make_coro, on_failure)
+
+    def submit_many(self, user_ids, make_coro: Callable[[], Awaitable[Any]],
+                    on_failure: Callable[[], None] | None = None) -> asyncio.Task:
+        """Одна запись сразу на нескольких игроков (пачкой): выполняется после
+        уже поставленных записей каждого из них и до следующих"""
+        user_ids = set(user_ids)
+        previous = {self._tails[user_id] for user_id in user_ids if user_id in self._tails}
+        task = asyncio.create_task(self._run(previous, make_coro, on_failure))
+        for user_id in user_ids:
+            self._tails[user_id] = task
+        self.pending += 1
+
+        def done(t: asyncio.Task):
+            self.pending -= 1
+            for user_id in user_ids:
+                if self._tails.get(user_id) is t:
+                    del self._tails[user_id]
+        task.add_done_callback(done)
+        return task
+
+    async def _run(self, previous: set, make_coro, on_failure):
+        if previous:
+            await asyncio.wait(previous)
+        for attempt in range(self.retries):
+            try:
+                return await make_coro()
+            except Exception as e:
+                if attempt == self.retries - 1:
+                    PERSIST_FAILURES.inc()
+                    logger.error(f"Persist failed after {self.retries} attempts: {e}")
+                    if on_failure is not None:
+                        on_failure()
+                    return None
+                delay = self.base_delay * 2 ** attempt
+                logger.warning(f"Persist error (attempt {attempt + 1}, retry in {delay:.1f}s): {e}")
+                await asyncio.sleep(delay)
+
+    async def wait(self, user_id: int):
+        """Дождаться всех поставленных записей игрока (read-your-writes)"""
+        tail = self._tails.get(user_id)
+        if tail is not None:
+            await asyncio.wait([tail])
+
+    async def drain(self):
+        """Дождаться всех записей (при остановке)"""
+        while self._tails:
+            await asyncio.wait(set(self._tails.values()))
@@ -0,0 +1,104 @@
+"""
+🔥 Встроенный сэмплирующий профайлер
+Фоновый поток раз в N мс снимает стек потока event loop и копит счётчики.
+Результат — collapsed stacks (для flamegraph.pl / speedscope) и топ функций.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+_MAX_DEPTH = 128
+
+
+class SamplingProfiler:
+    """Сэмплирует стек одного потока (по умолчанию — того, где вызван start)"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at = 0.0
+        self.duration = 0.0
+        self._labels: dict = {}
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._target_id = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, thread_id: int | None = None):
+        if self.running:
+            raise RuntimeError("Profiler is already running")
+        self._target_id = thread_id or threading.get_ident()
+        self._stop.clear()
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> "SamplingProfiler":
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.duration = time.perf_counter() - self.started_at
+        return self
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < _MAX_DEPTH:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+            self.samples += 1
+
+    # ============ РЕЗУЛЬТАТЫ ============
+
+    def collapsed(self) -> str:
+        """Формат collapsed stacks: «корень;...;лист количество»"""
+        return "\n".join(
+            f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common()
+        ) + "\n"
+
+    def write_collapsed(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.collapsed())
+
+    def top_functions(self, limit: int = 15) -> list:
+        """[(функция, self-сэмплы, total-сэмплы)] по убыванию self"""
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        for stack, count in self.stacks.items():
+            if not stack:
+                continue
+            self_counts[stack[-1]] += count
+            for label in set(stack):
+                total_counts[label] += count
+        return [(label, count, total_counts[label]) for label, count in self_counts.most_common(limit)]
+
+    def summary(self, limit: int = 15) -> str:
+        """Текстовая сводка: топ функций по собственному времени"""
+        total = self.samples or 1
+        lines = [
+            f"Сэмплов: {self.samples} за {self.duration:.1f} с (интервал {self.interval * 1000:.0f} мс)",
+            f"{'self %':>7} {'total %':>8}  функция",
+        ]
+        for label, own, cumulative in self.top_functions(limit):
+            lines.append(f"{own / total * 100:>6.1f}% {cumulative / total * 100:>7.1f}%  {label}")
+        return "\n".join(lines)
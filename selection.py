@@ -0,0 +1,203 @@
+"""
+🎯 Подбор вопросов под уровень игрока
+Статистика по аниме (ответы/правильные) и путаница (какой неверный вариант
+выбрали вместо правильного) копятся инкрементально на каждом ответе.
+Путаница сохраняется в БД приращениями (take_unsaved) и загружается при старте.
+Вопросы и дистракторы берутся из alias-таблиц (метод Возе, O(1) на выборку),
+таблицы перестраиваются в фоне, когда статистика заметно изменилась.
+"""
+import asyncio
+import math
+import random
+
+from anime_data import ANIME_LIST, ANIME_BY_ID, QUOTE_POOL, RARITY_POOLS, CATALOG_STATE
+
+# Априорная точность нового аниме и её вес (в ответах)
+PRIOR_ACCURACY = 0.6
+PRIOR_WEIGHT = 5
+
+# Уровни игрока: 0 — новичок, 1 — средний, 2 — опытный
+SKILL_MIN_GAMES = 10               # До стольких игр — всегда новичок
+SKILL_ACCURACY = (0.5, 0.75)       # Пороги точности для уровней 1 и 2
+BAND_TARGETS = (0.25, 0.4, 0.55)   # Целевая сложность (доля ошибок) по уровням
+BAND_WIDTH = 0.15                  # Насколько строго держимся цели
+WEIGHT_FLOOR = 0.05                # Любое аниме остаётся возможным
+CONFUSION_SHARE = (0.2, 0.4, 0.6)  # Доля дистракторов из таблицы путаницы по уровням
+
+REBUILD_MIN_ANSWERS = 50           # Перестраивать не чаще, чем раз в столько ответов
+REBUILD_DRIFT = 0.05               # ...и не раньше, чем новых ответов станет 5% от выборки
+
+
+def build_alias(weights: list) -> tuple[list, list]:
+    """Alias-таблица Возе: (prob, alias) для выборки за O(1)"""
+    n = len(weights)
+    total = sum(weights)
+    if n == 0 or total <= 0:
+        return [1.0] * n, list(range(n))
+    scaled = [w * n / total for w in weights]
+    prob = [0.0] * n
+    alias = list(range(n))
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] -= 1.0 - scaled[s]
+        (small if scaled[l] < 1.0 else large).append(l)
+    for i in small + large:
+        prob[i] = 1.0
+    return prob, alias
+
+
+def alias_draw(prob: list, alias: list) -> int:
+    """Индекс из alias-таблицы"""
+    i = int(random.random() * len(prob))
+    return i if random.random() < prob[i] else alias[i]
+
+
+def skill_band(player: dict | None) -> int:
+    """Уровень игрока по точности ответов"""
+    if not player:
+        return 0
+    games = player["correct_answers"] + player["wrong_answers"]
+    if games < SKILL_MIN_GAMES:
+        return 0
+    accuracy = player["correct_answers"] / games
+    return sum(accuracy >= threshold for threshold in SKILL_ACCURACY)
+
+
+def _difficulty(stats: list | None) -> float:
+    """Сглаженная доля ошибок по аниме"""
+    answers, correct = stats or (0, 0)
+    return (answers - correct + (1 - PRIOR_ACCURACY) * PRIOR_WEIGHT) / (answers + PRIOR_WEIGHT)
+
+
+def _build_tables(pools: dict, anime_stats: dict, confusion: dict) -> tuple[dict, dict]:
+    """Таблицы вопросов (пул, уровень) и дистракторов по снимку статистики"""
+    questions = {}
+    for pool_name, pool in pools.items():
+        difficulties = [_difficulty(anime_stats.get(anime["id"])) for anime in pool]
+        for band, target in enumerate(BAND_TARGETS):
+            weights = [
+                math.exp(-0.5 * ((d - target) / BAND_WIDTH) ** 2) + WEIGHT_FLOOR for d in difficulties
+            ]
+            questions[pool_name, band] = (pool, *build_alias(weights))
+
+    distractors = {}
+    for anime_id, picks in confusion.items():
+        ids = list(picks)
+        distractors[anime_id] = (ids, *build_alias([picks[i] for i in ids]))
+    return questions, distractors
+
+
+class SelectionEngine:
+    """Статистика ответов + alias-таблицы для create_game"""
+
+    def __init__(self):
+        self.anime_stats: dict[int, list] = {}          # anime_id -> [ответов, правильных]
+        self.confusion: dict[int, dict[int, int]] = {}  # правильное -> {выбранное неверное: раз}
+        self.questions: dict = {}                       # (пул, уровень) -> (аниме, prob, alias)
+        self.distractors: dict = {}                     # anime_id -> (ids, prob, alias)
+        self.built_version = -1
+        self.answers_at_build = 0
+        self.pending = 0                                # Ответов с последней перестройки
+        self.unsaved: dict[tuple, int] = {}             # (правильное, выбранное) -> раз, ещё не в БД
+
+    def seed(self, stats: dict, confusion: dict | None = None):
+        """Начальная статистика {anime_id: (ответов, правильных)} (из свёрток истории)
+        и путаница {правильное: {выбранное: раз}} (из БД)"""
+        self.anime_stats = {anime_id: [answers, correct] for anime_id, (answers, correct) in stats.items()}
+        if confusion is not None:
+            self.confusion = {anime_id: dict(picks) for anime_id, picks in confusion.items()}
+        self.pending = sum(answers for answers, _ in self.anime_stats.values())
+        self.answers_at_build = 0
+        self.built_version = -1
+
+    def record_answer(self, correct_id: int, chosen_id: int):
+        """Учесть ответ: точность по аниме и путаницу"""
+        stats = self.anime_stats.setdefault(correct_id, [0, 0])
+        stats[0] += 1
+        if chosen_id == correct_id:
+            stats[1] += 1
+        else:
+            picks = self.confusion.setdefault(correct_id, {})
+            picks[chosen_id] = picks.get(chosen_id, 0) + 1
+            key = (correct_id, chosen_id)
+            self.unsaved[key] = self.unsaved.get(key, 0) + 1
+        self.pending += 1
+
+    def take_unsaved(self) -> dict:
+        """Забрать несохранённые приращения путаницы (для db.add_confusion)"""
+        unsaved, self.unsaved = self.unsaved, {}
+        return unsaved
+
+    def restore_unsaved(self, deltas: dict):
+        """Вернуть приращения, которые не удалось записать"""
+        for key, picks in deltas.items():
+            self.unsaved[key] = self.unsaved.get(key, 0) + picks
+
+    def needs_rebuild(self) -> bool:
+        if self.built_version != CATALOG_STATE["version"]:
+            return True
+        return self.pending >= max(REBUILD_MIN_ANSWERS, REBUILD_DRIFT * self.answers_at_build)
+
+    def _snapshot(self) -> tuple:
+        pools = {"image": list(ANIME_LIST), "quote": list(QUOTE_POOL)}
+        stats = {anime_id: tuple(s) for anime_id, s in self.anime_stats.items()}
+        confusion = {anime_id: dict(picks) for anime_id, picks in self.confusion.items()}
+        return pools, stats, confusion
+
+    def _apply(self, tables: tuple, version: int, pending: int):
+        self.questions, self.distractors = tables
+        self.built_version = version
+        self.answers_at_build += pending
+        self.pending -= pending
+
+    def rebuild(self):
+        """Перестроить таблицы синхронно (первый запуск, смена каталога)"""
+        version, pending = CATALOG_STATE["version"], self.pending
+        self._apply(_build_tables(*self._snapshot()), version, pending)
+
+    async def rebuild_async(self):
+        """Перестроить таблицы в потоке, не блокируя event loop"""
+        version, pending = CATALOG_STATE["version"], self.pending
+        tables = await asyncio.to_thread(_build_tables, *self._snapshot())
+        self._apply(tables, version, pending)
+
+    # ============ ВЫБОРКА ============
+
+    def pick_question(self, mode: str, band: int = 0) -> dict:
+        """Аниме для вопроса с учётом сложности и уровня игрока"""
+        if self.built_version != CATALOG_STATE["version"]:
+            self.rebuild()
+        pool, prob, alias = self.questions["quote" if mode == "quote" else "image", band]
+        return pool[alias_draw(prob, alias)]
+
+    def pick_distractors(self, correct: dict, count: int, band: int = 0) -> list:
+        """count неверных вариантов: часть — из тех, с кем это аниме путают,
+        остальные — случайные той же редкости (или из всего каталога)"""
+        chosen = {correct["id"]}
+        result = []
+        confused = self.distractors.get(correct["id"])
+        pool = RARITY_POOLS.get(correct["rarity"], [])
+        if len(pool) <= count:
+            pool = ANIME_LIST
+        for _ in range(count * 8):
+            if len(result) == count:
+                return result
+            if confused and random.random() < CONFUSION_SHARE[band]:
+                ids, prob, alias = confused
+                anime = ANIME_BY_ID.get(ids[alias_draw(prob, alias)])
+            else:
+                anime = pool[int(random.random() * len(pool))]
+            if anime is not None and anime["id"] not in chosen:
+                chosen.add(anime["id"])
+                result.append(anime)
+
+        # Маленький каталог: добираем без повторов
+        rest = [a for a in ANIME_LIST if a["id"] not in chosen]
+        return result + random.sample(rest, min(count - len(result), len(rest)))
+
+
+engine = SelectionEngine()
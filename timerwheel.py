@@ -0,0 +1,105 @@
+"""
+⏲ Иерархическое колесо таймеров
+Таймеры (таймауты игр) раскладываются по слотам колёс: нижнее колесо —
+по тику, каждое следующее — по полному обороту предыдущего. Постановка и
+отмена — O(1), тик — O(1) плюс сработавшие таймеры; когда нижнее колесо
+делает оборот, слот следующего уровня опускается вниз. Одна задача на все
+таймеры вместо asyncio.sleep на каждую игру.
+"""
+import asyncio
+import logging
+import math
+import time
+from typing import Any, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class TimingWheel:
+    """Таймеры по ключу: schedule / cancel / run(on_expire)"""
+
+    def __init__(self, tick: float = 0.25, wheel_size: int = 256, levels: int = 3):
+        self.tick = tick
+        self.size = wheel_size
+        self.levels = levels
+        # _wheels[уровень][слот] = {ключ: (тик срабатывания, payload)}
+        self._wheels = [[{} for _ in range(wheel_size)] for _ in range(levels)]
+        self._index: dict[Hashable, tuple[int, int]] = {}   # ключ -> (уровень, слот)
+        self._origin = time.monotonic()
+        self._now = 0   # Последний обработанный тик
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._index
+
+    def schedule(self, key: Hashable, delay: float, payload: Any = None):
+        """Поставить (или переставить) таймер key через delay секунд"""
+        self.cancel(key)
+        deadline = time.monotonic() + delay - self._origin
+        expires = max(self._now + 1, math.ceil(deadline / self.tick))
+        self._place(key, expires, payload)
+
+    def cancel(self, key: Hashable) -> bool:
+        """Снять таймер. False — его не было (уже сработал или снят)"""
+        where = self._index.pop(key, None)
+        if where is None:
+            return False
+        level, slot = where
+        del self._wheels[level][slot][key]
+        return True
+
+    def _place(self, key: Hashable, expires: int, payload: Any):
+        diff = expires - self._now
+        level, span = 0, self.size
+        while diff >= span and level < self.levels - 1:
+            level += 1
+            span *= self.size
+        if diff >= span:
+            expires = self._now + span - 1     # Дальше горизонта — на край верхнего колеса
+        slot = (expires // self.size ** level) % self.size
+        self._wheels[level][slot][key] = (expires, payload)
+        self._index[key] = (level, slot)
+
+    def advance(self, now: float | None = None) -> list:
+        """Прокрутить колёса до текущего времени. Возвращает [(ключ, payload)] сработавших"""
+        target = int(((time.monotonic() if now is None else now) - self._origin) / self.tick)
+        fired = []
+        while self._now < target:
+            self._now += 1
+            # Оборот нижнего колеса — опускаем слоты верхних уровней (сначала старшие)
+            for level in range(self.levels - 1, 0, -1):
+                if self._now % self.size ** level == 0:
+                    self._cascade(level, (self._now // self.size ** level) % self.size)
+            slot = self._wheels[0][self._now % self.size]
+            if slot:
+                for key, (_, payload) in slot.items():
+                    del self._index[key]
+                    fired.append((key, payload))
+                slot.clear()
+        return fired
+
+    def _cascade(self, level: int, slot_index: int):
+        slot = self._wheels[level][slot_index]
+        if not slot:
+            return
+        items = list(slot.items())
+        slot.clear()
+        for key, (expires, payload) in items:
+            del self._index[key]
+            self._place(key, expires, payload)
+
+    async def run(self, on_expire: Callable[[list], None]):
+        """Задача колеса: каждый тик отдаёт пачку сработавших таймеров в on_expire"""
+        if not self._index:
+            self._origin, self._now = time.monotonic(), 0
+        while True:
+            next_tick = self._origin + (self._now + 1) * self.tick
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+            fired = self.advance()
+            if fired:
+                try:
+                    on_expire(fired)
+                except Exception as e:
+                    logger.error(f"Timer callback error ({len(fired)} timers): {e}")
@@ -0,0 +1,127 @@
+"""
+🔍 Трассировка апдейтов: дерево спанов на contextvars
+Корневой спан создаёт middleware на каждый апдейт, дочерние — обработчик,
+вызовы database.*, запросы к Jikan и к Telegram Bot API.
+Медленные апдейты (дольше порога) пишутся в лог одной JSON-строкой.
+"""
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+logger = logging.getLogger(__name__)
+
+_current_span: ContextVar["Span | None"] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """Узел дерева трассировки"""
+    __slots__ = ("name", "attrs", "start", "end", "children")
+
+    def __init__(self, name: str, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end = None
+        self.children: list[Span] = []
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def to_dict(self, origin: float | None = None) -> dict:
+        origin = self.start if origin is None else origin
+        data = {
+            "name": self.name,
+            "at_ms": round((self.start - origin) * 1000, 2),
+            "ms": round(self.duration * 1000, 2),
+        }
+        if self.attrs:
+            data["attrs"] = self.attrs
+        if self.children:
+            data["children"] = [child.to_dict(origin) for child in self.children]
+        return data
+
+
+def current_span() -> Span | None:
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Дочерний спан текущего апдейта (без активной трассировки ничего не делает)"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, **attrs)
+    parent.children.append(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        child.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+class UpdateTracingMiddleware(BaseMiddleware):
+    """Outer middleware для dp.update: корневой спан и лог медленных апдейтов"""
+
+    def __init__(self, slow_threshold: float):
+        self.slow_threshold = slow_threshold
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        root = Span(
+            "update",
+            update_id=event.update_id,
+            type=event.event_type,
+            user_id=user.id if user else None,
+        )
+        token = _current_span.set(root)
+        try:
+            return await handler(event, data)
+        except BaseException as e:
+            root.attrs["error"] = type(e).__name__
+            raise
+        finally:
+            root.end = time.perf_counter()
+            _current_span.reset(token)
+            if root.duration >= self.slow_threshold:
+                logger.warning("Slow update: %s", json.dumps(root.to_dict(), ensure_ascii=False))
+
+
+class HandlerTracingMiddleware(BaseMiddleware):
+    """Inner middleware: спан с именем сработавшего обработчика"""
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        with span(f"handler:{name}"):
+            return await handler(event, data)
+
+
+class TelegramTracingMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: спан на каждый вызов Bot API"""
+
+    async def __call__(self, make_request, bot, method):
+        with span(f"telegram:{method.__api_method__}"):
+            return await make_request(bot, method)
@@ -0,0 +1,148 @@
+"""
+📨 Смена экранов минимумом вызовов Telegram API
+Экран — текст или фото с подписью + клавиатура. Транспорт помнит, какое
+сообщение сейчас в чате (текст или фото), и переходит на новый экран
+одним вызовом: edit_message_text (текст → текст), edit_message_media
+(фото → фото), edit_message_caption (фото → текст под той же картинкой,
+если разрешено). Удаление + новая отправка — только когда редактированием
+не обойтись (текст ↔ фото, сообщение не найдено или устарело).
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup, InputMediaPhoto
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+TEXT = "text"
+PHOTO = "photo"
+CAPTION_LIMIT = 1024   # Максимальная длина подписи к фото в Telegram
+
+TRANSITIONS = metrics.Counter(
+    "anime_screen_transitions_total", "Смены экранов по способу (edit_* — один вызов API)", ("method",)
+)
+
+
+def message_kind(message: types.Message | None) -> str | None:
+    """Тип сообщения: фото, текст или None (недоступно / неизвестно)"""
+    if message is None:
+        return None
+    if getattr(message, "photo", None):
+        return PHOTO
+    if getattr(message, "text", None) is not None:
+        return TEXT
+    return None
+
+
+class MessageTransport:
+    """Текущее сообщение каждого чата + переходы между экранами"""
+
+    def __init__(self, bot: Bot, max_chats: int = 100_000):
+        self.bot = bot
+        self.max_chats = max_chats
+        self._current: OrderedDict[int, tuple[int, str]] = OrderedDict()  # chat_id -> (message_id, тип)
+
+    def remember(self, chat_id: int, message: types.Message | None):
+        """Запомнить сообщение, которое сейчас показывает экран чата"""
+        kind = message_kind(message)
+        if kind is None:
+            return
+        self._current[chat_id] = (message.message_id, kind)
+        self._current.move_to_end(chat_id)
+        while len(self._current) > self.max_chats:
+            self._current.popitem(last=False)
+
+    def current(self, chat_id: int, message: types.Message | None = None) -> tuple[int, str] | None:
+        """(message_id, тип) сообщения, которое будем менять.
+        message — сообщение с нажатой кнопкой (его содержимое надёжнее памяти)"""
+        if message is None:
+            return self._current.get(chat_id)
+        kind = message_kind(message)
+        if kind is None:
+            # Недоступное сообщение (старше 48 ч) — тип знаем, только если сами его слали
+            known = self._current.get(chat_id)
+            if known and known[0] == message.message_id:
+                return known
+            return message.message_id, None
+        return message.message_id, kind
+
+    async def show(self, chat_id: int, text: str, reply_markup: InlineKeyboardMarkup | None = None,
+                   photo: str | None = None, message: types.Message | None = None,
+                   keep_photo: bool = False) -> types.Message | None:
+        """Показать экран вместо текущего сообщения чата.
+        photo — file_id или URL картинки (экран-фото, text — подпись).
+        keep_photo — текстовый экран можно показать подписью под текущей картинкой.
+        Возвращает новое/изменённое сообщение (None, если не изменилось)."""
+        current = self.current(chat_id, message)
+        if current is None:
+            return await self._send(chat_id, text, reply_markup, photo, method="send")
+        return await self.replace(chat_id, *current, text, reply_markup, photo, keep_photo)
+
+    async def replace(self, chat_id: int, message_id: int, kind: str | None, text: str,
+                      reply_markup: InlineKeyboardMarkup | None = None, photo: str | None = None,
+                      keep_photo: bool = False) -> types.Message | None:
+        """Показать экран вместо известного сообщения (message_id, тип) — как show"""
+        try:
+            if photo is None and kind == TEXT:
+                result = await self.bot.edit_message_text(
+                    text=text, chat_id=chat_id, message_id=message_id, reply_markup=reply_markup
+                )
+                method = "edit_text"
+            elif photo is not None and kind == PHOTO:
+                result = await self.bot.edit_message_media(
+                    media=InputMediaPhoto(media=photo, caption=text),
+                    chat_id=chat_id, message_id=message_id, reply_markup=reply_markup,
+                )
+                method = "edit_media"
+            elif photo is None and kind == PHOTO and keep_photo and len(text) <= CAPTION_LIMIT:
+                result = await self.bot.edit_message_caption(
+                    caption=text, chat_id=chat_id, message_id=message_id, reply_markup=reply_markup
+                )
+                method = "edit_caption"
+            else:
+                # Текст <-> фото редактированием не поменять
+                return await self._resend(chat_id, message_id, text, reply_markup, photo)
+        except TelegramBadRequest as e:
+            if "message is not modified" in e.message:
+                return None
+            logger.debug(f"Edit failed in chat {chat_id}, resending: {e.message}")
+            return await self._resend(chat_id, message_id, text, reply_markup, photo)
+
+        TRANSITIONS.inc(method=method)
+        if isinstance(result, types.Message):
+            self.remember(chat_id, result)
+            return result
+        return None
+
+    async def send(self, chat_id: int, text: str, reply_markup: InlineKeyboardMarkup | None = None,
+                   photo: str | None = None) -> types.Message:
+        """Новое сообщение (старое остаётся в чате)"""
+        return await self._send(chat_id, text, reply_markup, photo, method="send")
+
+    async def _resend(self, chat_id: int, message_id: int, text: str,
+                      reply_markup: InlineKeyboardMarkup | None, photo: str | None) -> types.Message:
+        """Удалить старое и отправить новое — параллельно"""
+        # (методы aiogram — не корутины, поэтому ensure_future)
+        _, sent = await asyncio.gather(
+            asyncio.ensure_future(self.bot.delete_message(chat_id=chat_id, message_id=message_id)),
+            asyncio.ensure_future(self._send(chat_id, text, reply_markup, photo, method="resend")),
+            return_exceptions=True,
+        )
+        if isinstance(sent, BaseException):
+            raise sent
+        return sent
+
+    async def _send(self, chat_id: int, text: str, reply_markup: InlineKeyboardMarkup | None,
+                    photo: str | None, method: str) -> types.Message:
+        if photo is not None:
+            sent = await self.bot.send_photo(chat_id=chat_id, photo=photo, caption=text, reply_markup=reply_markup)
+        else:
+            sent = await self.bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+        TRANSITIONS.inc(method=method)
+        self.remember(chat_id, sent)
+        return sent